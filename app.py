@@ -1,45 +1,132 @@
 """
 API - FLASK COURSE | SECTION 5
 Storing Resources in SQL Database
+The application factory. Importing this module has no side effects: every app is
+built, configured and wired by create_app().
 """
+import logging
 import os
 
 from flask import Flask
 from flask_restful import Api
 from flask_jwt import JWT
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import configure_mappers
 
-from resources.item import Item, ItemList
+from resources.item import Item, ItemList, ItemBulk, ItemSearch
 from security import authenticate, identity
 from resources.user import UserRegister, User
-from resources.store import Store, StoreList
+from resources.store import Store, StoreList, StoreSummary, StoreSummaryList
+from resources.stats import Stats
+from models.item import ItemModel
+from models.store import StoreModel
+from models.user import UserModel
+from models.version import DataVersionModel
 
-from db import db
+import cache
+import compression
+import metrics
+import replicas
+import representations
+import slowlog
+import timing
+from config import SECRET_KEY
+from db import db, init_db
 
-app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", 'sqlite:///data.db')
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["PROPAGATE_EXCEPTIONS"] = True
-app.secret_key = 'jose'
-api = Api(app)
+logger = logging.getLogger(__name__)
 
+# The /auth endpoint, added to every app by create_app().
+jwt = JWT(authentication_handler=authenticate, identity_handler=identity)
 
-@app.before_first_request
-def create_tables():
+
+def register_resources(api):
     """
-    Before the first request, create database.
+    Adds the resources of the API.
+    :param api:
     """
-    db.create_all()
+    api.add_resource(Store, '/store/<string:name>')
+    api.add_resource(StoreSummary, '/store/<string:name>/summary')
+    api.add_resource(Item, '/item/<string:name>')
+    api.add_resource(ItemList, '/items')
+    api.add_resource(ItemBulk, '/items/bulk')
+    api.add_resource(ItemSearch, '/items/search')
+    api.add_resource(StoreList, '/stores')
+    api.add_resource(StoreSummaryList, '/stores/summary')
+    api.add_resource(UserRegister, '/register')
+    api.add_resource(User, '/user/<int:user_id>')
+    api.add_resource(Stats, '/stats')
 
 
-jwt = JWT(app, authenticate, identity)  # /auth endpoint
-print("Hey")
-api.add_resource(Store, '/store/<string:name>')
-api.add_resource(Item, '/item/<string:name>')
-api.add_resource(ItemList, '/items')
-api.add_resource(StoreList, '/stores')
-api.add_resource(UserRegister, '/register')
-api.add_resource(User, '/user/<int:user_id>')
+def create_app(config=None):
+    """
+    Builds an app configured from the environment, then from config. Every app gets its
+    own Api, so several of them, e.g. against different databases, can live in one
+    process. Call init_db() on it to create the missing tables.
+    :param config: a dict of config keys overriding the environment.
+    :return:
+    """
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", 'sqlite:///data.db')
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["PROPAGATE_EXCEPTIONS"] = True
+    app.config["DATABASE_REPLICA_URLS"] = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URL", "").split(",")
+                                           if url.strip()]
+    app.config["REPLICA_STICKY_SECONDS"] = float(os.environ.get("REPLICA_STICKY_SECONDS",
+                                                 replicas.DEFAULT_STICKY_SECONDS))
+    app.config["DB_POOL_SIZE"] = int(os.environ.get("DB_POOL_SIZE", 5))
+    app.config["DB_MAX_OVERFLOW"] = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    app.config["DB_POOL_RECYCLE"] = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    app.config["DB_POOL_PRE_PING"] = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+    app.config["DB_POOL_TIMEOUT"] = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+    app.config["CACHE_MAXSIZE"] = int(os.environ.get("CACHE_MAXSIZE", cache.DEFAULT_MAXSIZE))
+    app.config["CACHE_TTL"] = float(os.environ.get("CACHE_TTL", cache.DEFAULT_TTL))
+    app.config["IDENTITY_CACHE_TTL"] = float(os.environ.get("IDENTITY_CACHE_TTL", cache.DEFAULT_IDENTITY_TTL))
+    app.config["BULK_CHUNK_SIZE"] = int(os.environ.get("BULK_CHUNK_SIZE", 250))
+    app.config["JSON_ENCODER"] = os.environ.get("JSON_ENCODER", "auto")
+    app.config["COMPRESS_MIN_SIZE"] = int(os.environ.get("COMPRESS_MIN_SIZE", compression.DEFAULT_MIN_SIZE))
+    app.config["COMPRESS_GZIP_LEVEL"] = int(os.environ.get("COMPRESS_GZIP_LEVEL", compression.DEFAULT_GZIP_LEVEL))
+    app.config["COMPRESS_BROTLI_QUALITY"] = int(os.environ.get("COMPRESS_BROTLI_QUALITY",
+                                                compression.DEFAULT_BROTLI_QUALITY))
+    app.config["SERVER_TIMING"] = os.environ.get("SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+    app.config["SLOW_QUERY_MS"] = float(os.environ.get("SLOW_QUERY_MS", slowlog.DEFAULT_THRESHOLD_MS))
+    app.secret_key = SECRET_KEY
+    app.config.update(config or {})
 
-if __name__ == '__main__':
     db.init_app(app)
+    replicas.init_app(app)
+    api = Api(app)
+    representations.init_app(app, api)
+    timing.init_app(app)
+    compression.init_app(app)
+    cache.init_app(app)
+    metrics.init_app(app)
+    slowlog.init_app(app)
+    jwt.init_app(app)
+    register_resources(api)
+    return app
+
+
+def warm_up(app):
+    """
+    Configures the mappers, compiles the statements of the hot paths and opens a
+    connection, so that the first request of a worker doesn't pay for them.
+    :param app:
+    """
+    with app.app_context():
+        configure_mappers()
+        try:
+            ItemModel.find_by_name('')
+            StoreModel.find_id_by_name('')
+            UserModel.find_by_username('')
+            DataVersionModel.find_versions(['items', 'stores'])
+        except SQLAlchemyError as e:
+            # e.g. INIT_DB is off and `flask init-db` didn't run yet.
+            logger.warning("Could not warm up: %s", e)
+        finally:
+            db.session.remove()
+
+
+if __name__ == '__main__':
+    app = create_app()
+    init_db(app)
     app.run(port=5000, debug=True)
@@ -0,0 +1,628 @@
+"""
+ASGI
+The resources of the API on an async SQLAlchemy session, served by any ASGI server:
+
+    uvicorn asgi:app --workers 4
+
+It answers /item/<name>, /items, /store/<name>, /stores, /register, /user/<id> and
+/auth with the same JSON bodies, status codes and JWTs as run:app, on the same
+database. The in-process caches, ETags, compression, bulk upserts, /stats and
+/metrics stay with the Flask app.
+"""
+import contextlib
+import datetime
+import functools
+import json
+import os
+
+import jwt
+from flask_jwt import CONFIG_DEFAULTS as JWT_CONFIG, JWTError
+from flask_restful import inputs
+from sqlalchemy import delete, event, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import selectinload, sessionmaker
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.exceptions import BadRequest, default_exceptions
+from werkzeug.security import safe_str_cmp
+
+from config import SECRET_KEY
+from db import SQLITE_PRAGMAS, apply_sqlite_pragmas, upsert_returning
+from fieldsets import EMBEDS, fieldset, select_fields, split_fields
+from models.item import ItemModel
+from models.store import StoreModel
+from models.user import UserModel
+from models.version import DataVersionModel
+from pagination import DEFAULT_LIMIT, page_limit, page_query, page_result
+from representations import encoder_named
+from resources.item import finite_float
+from streaming import DEFAULT_CHUNK_SIZE, json_list_delimiters
+
+# The async drivers, by the driver of the DATABASE_URL run:app uses.
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite',
+                 'postgres': 'postgresql+asyncpg',
+                 'postgresql': 'postgresql+asyncpg',
+                 'postgresql+psycopg2': 'postgresql+asyncpg'}
+
+
+class APIError(Exception):
+    """
+    Ends a request with {'message': message} and the given status code.
+    """
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class JSONResponse(Response):
+    """
+    A response encoded like output_json() in representations.py.
+    """
+    media_type = 'application/json'
+    dumps = staticmethod(encoder_named(os.environ.get('JSON_ENCODER', 'auto')))
+
+    def render(self, content):
+        return self.dumps(content) + b'\n'
+
+
+def async_url(url):
+    """
+    Returns url with the async driver of its database, see ASYNC_DRIVERS.
+    :param url:
+    :return:
+    """
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+def create_engine(url):
+    """
+    Creates the async engine of url, with the SQLite pragmas or the pool settings
+    run:app uses.
+    :param url:
+    :return:
+    """
+    url = async_url(url)
+    if url.get_backend_name() == 'sqlite':
+        engine = create_async_engine(url)
+        pragmas = [(pragma, value) for pragma, value in SQLITE_PRAGMAS.values() if value is not None]
+        # The pragmas run on the driver's connection, wrapped for synchronous use.
+        event.listen(engine.sync_engine, 'connect', functools.partial(apply_sqlite_pragmas, pragmas))
+        return engine
+    return create_async_engine(
+        url,
+        pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        pool_pre_ping=os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+        pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", 30)))
+
+
+async def request_values(request):
+    """
+    The query string and JSON body of a request in one dict, the locations reqparse reads.
+    :param request:
+    :return:
+    """
+    values = dict(request.query_params)
+    if request.headers.get('content-type', '').split(';')[0].strip() == 'application/json':
+        try:
+            data = json.loads(await request.body())
+        except ValueError:
+            raise APIError(BadRequest.description)
+        if isinstance(data, dict):
+            values.update(data)
+    return values
+
+
+async def parse_args(request, arguments):
+    """
+    Parses the required arguments of a request like a reqparse.RequestParser: the
+    first missing or invalid one ends the request with its help message.
+    :param request:
+    :param arguments: a list of (name, type, help) tuples.
+    :return: a dict of the converted arguments.
+    """
+    values = await request_values(request)
+    args = {}
+    for name, type_, help_ in arguments:
+        try:
+            args[name] = type_(values[name])
+        except (KeyError, TypeError, ValueError):
+            raise APIError({name: help_})
+    return args
+
+
+def pagination_args(request):
+    """
+    Parses the query string arguments of pagination.pagination_parser.
+    :param request:
+    :return:
+    """
+    params = request.query_params
+    args = {'cursor': params.get('cursor')}
+    for name, type_, default in (('limit', page_limit, DEFAULT_LIMIT), ('paginate', inputs.boolean, True),
+                                 ('stream', inputs.boolean, False)):
+        try:
+            args[name] = type_(params[name]) if name in params else default
+        except ValueError as e:
+            raise APIError({name: str(e)})
+    return args
+
+
+def fieldset_args(request, names, embed=False):
+    """
+    Parses the query string arguments of fieldsets.add_fields_arguments().
+    :param request:
+    :param names: the fields that can be picked.
+    :param embed: whether the resource takes ?embed= too.
+    :return: a dict with the parsed 'fields', and 'embed' if asked for.
+    """
+    params = request.query_params
+    args = {}
+    try:
+        args['fields'] = fieldset(names)(params['fields']) if 'fields' in params else None
+    except ValueError as e:
+        raise APIError({'fields': str(e)})
+    if embed:
+        args['embed'] = params.get('embed', 'items')
+        if args['embed'] not in EMBEDS:
+            raise APIError({'embed': '{} is not a valid choice'.format(args['embed'])})
+    return args
+
+
+def store_shape(request):
+    """
+    Parses ?fields= and ?embed= of the store resources, see resources.store.fieldset_args().
+    :param request:
+    :return: a (fields, item_fields, embed) tuple.
+    """
+    args = fieldset_args(request, StoreModel.FIELDS, embed=True)
+    fields, item_fields = split_fields(args['fields'], 'items')
+    return fields, item_fields, args['embed'] == 'items'
+
+
+def select_store_fields(found, fields, item_fields, embed):
+    """
+    Returns a store in JSON format with the fields of store_shape(), like run:app does.
+    :param found: a StoreModel with its items loaded.
+    :param fields:
+    :param item_fields:
+    :param embed:
+    :return:
+    """
+    if (fields, item_fields, embed) == (None, None, True):
+        return found.json()
+    narrowed = select_fields({'id': found.id, 'name': found.name}, fields or ('id', 'name'))
+    if embed:
+        narrowed['items'] = [select_fields(item.json(), item_fields) for item in found.items]
+    return narrowed
+
+
+def item_filter_args(request):
+    """
+    Parses the filter and sort arguments of resources.item.ItemList.
+    :param request:
+    :return: a (sort, filters) tuple, see ItemModel.sort_key() and ItemModel.filters().
+    """
+    params = request.query_params
+    sort = params.get('sort', 'id')
+    if sort not in ItemModel.SORTS:
+        raise APIError({'sort': '{} is not a valid choice'.format(sort)})
+    filters = {}
+    for name, type_ in (('min_price', float), ('max_price', float), ('store_id', int)):
+        try:
+            filters[name] = type_(params[name]) if name in params else None
+        except ValueError as e:
+            raise APIError({name: str(e)})
+    return sort, filters
+
+
+def chunk_size():
+    """
+    The rows read from the database and written out at a time by streamed lists.
+    :return:
+    """
+    return int(os.environ.get('STREAM_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+
+
+async def stream_json_list(key, rows):
+    """
+    Yields the JSON document {key: [row, ...]} like streaming.generate_json_list().
+    :param key: the name of the list in the document.
+    :param rows: an async iterable of lists of rows in JSON (dict) format.
+    :return:
+    """
+    dumps = JSONResponse.dumps
+    prefix, next_separator, suffix = json_list_delimiters(dumps, key)
+    yield prefix
+    separator = b''
+    async for chunk in rows:
+        parts = []
+        for row in chunk:
+            parts.append(separator + dumps(row))
+            separator = next_separator
+        yield b''.join(parts)
+    yield suffix
+
+
+def new_session(request):
+    """
+    Opens a session on the app's engine, use it with `async with`.
+    :param request:
+    :return:
+    """
+    return request.app.state.sessionmaker()
+
+
+async def bump_versions(session, names):
+    """
+    Increments the given data versions in the session's transaction, see DataVersionModel.bump().
+    :param session:
+    :param names:
+    """
+    names = [name for name in names if name is not None]
+    if names:
+        await session.execute(DataVersionModel.bump_statement(names, session.bind.dialect.name))
+
+
+def encode_token(user):
+    """
+    Returns the JWT of user, with the claims Flask-JWT puts in its tokens.
+    :param user:
+    :return:
+    """
+    iat = datetime.datetime.utcnow()
+    payload = {'exp': iat + JWT_CONFIG['JWT_EXPIRATION_DELTA'],
+               'iat': iat,
+               'nbf': iat + JWT_CONFIG['JWT_NOT_BEFORE_DELTA'],
+               'identity': user.id}
+    token = jwt.encode(payload, SECRET_KEY, algorithm=JWT_CONFIG['JWT_ALGORITHM'])
+    # PyJWT 1.x returns bytes, 2.x a str.
+    return token.decode('utf-8') if isinstance(token, bytes) else token
+
+
+async def require_identity(request, session):
+    """
+    Returns the user of the request's JWT, or raises the JWTError of flask_jwt.jwt_required().
+    :param request:
+    :param session:
+    :return:
+    """
+    header = request.headers.get('Authorization')
+    if not header:
+        raise JWTError('Authorization Required', 'Request does not contain an access token',
+                       headers={'WWW-Authenticate': 'JWT realm="{}"'.format(JWT_CONFIG['JWT_DEFAULT_REALM'])})
+    parts = header.split()
+    if parts[0].lower() != JWT_CONFIG['JWT_AUTH_HEADER_PREFIX'].lower():
+        raise JWTError('Invalid JWT header', 'Unsupported authorization type')
+    elif len(parts) == 1:
+        raise JWTError('Invalid JWT header', 'Token missing')
+    elif len(parts) > 2:
+        raise JWTError('Invalid JWT header', 'Token contains spaces')
+
+    options = {'verify_' + claim: True for claim in JWT_CONFIG['JWT_VERIFY_CLAIMS']}
+    options.update({'require_' + claim: True for claim in JWT_CONFIG['JWT_REQUIRED_CLAIMS']})
+    try:
+        payload = jwt.decode(parts[1], SECRET_KEY, options=options, algorithms=[JWT_CONFIG['JWT_ALGORITHM']],
+                             leeway=JWT_CONFIG['JWT_LEEWAY'])
+    except jwt.InvalidTokenError as e:
+        raise JWTError('Invalid token', str(e))
+
+    user = await session.get(UserModel, payload['identity'])
+    if user is None:
+        raise JWTError('Invalid JWT', 'User does not exist')
+    return user
+
+
+async def upsert_item(session, name, price, store_id, overwrite=True):
+    """
+    The async ItemModel.upsert(), with the same single INSERT ... ON CONFLICT statement.
+    :param session:
+    :param name:
+    :param price:
+    :param store_id:
+    :param overwrite: update an existing item (PUT) or leave it untouched (POST).
+    :return: the item in JSON format, or None if it already existed and overwrite is False.
+    """
+    table = ItemModel.__table__
+    dialect = session.bind.dialect
+    statement = ItemModel.upsert_statement(name, price, store_id, overwrite, dialect.name)
+    returning = upsert_returning(statement, table.c, dialect)
+    if returning is not None:
+        row = (await session.execute(returning)).first()
+        item = dict(row._mapping) if row else None
+        if item is not None and item['price'] is not None:
+            item['price'] = float(item['price'])
+    else:
+        result = await session.execute(statement)
+        if result.rowcount == 0:
+            item = None
+        elif not overwrite:
+            item = {'id': result.inserted_primary_key[0],
+                    'name': name,
+                    'price': price,
+                    'store_id': store_id}
+        else:
+            item = dict((await session.execute(table.select().where(table.c.name == name))).first()._mapping)
+    if item is not None:
+        await bump_versions(session, ItemModel.version_names({store_id, item['store_id']}))
+    await session.commit()
+    return item
+
+
+ITEM_ARGUMENTS = [('price', finite_float, "This field cannot be left blank!"),
+                  ('store_id', int, "Every item needs a store ID.")]
+USER_ARGUMENTS = [('username', str, "This field cannot be blank."),
+                  ('password', str, "This field cannot be blank.")]
+
+
+async def item(request):
+    """
+    GET, POST, PUT and DELETE /item/<name>, see resources.item.Item.
+    :param request:
+    :return:
+    """
+    name = request.path_params['name']
+    async with new_session(request) as session:
+        if request.method == 'GET':
+            await require_identity(request, session)
+            fields = fieldset_args(request, ItemModel.FIELDS)['fields']
+            found = (await session.execute(select(ItemModel).filter_by(name=name))).scalars().first()
+            if found:
+                return JSONResponse(select_fields(found.json(), fields))
+            return JSONResponse({'message': 'Item not found'}, 404)
+
+        if request.method == 'DELETE':
+            found = (await session.execute(select(ItemModel).filter_by(name=name))).scalars().first()
+            if found:
+                await session.delete(found)
+                await bump_versions(session, ItemModel.version_names([found.store_id]))
+                await session.commit()
+            return JSONResponse({'message': 'Item deleted'})
+
+        args = await parse_args(request, ITEM_ARGUMENTS)
+        try:
+            found = await upsert_item(session, name, overwrite=request.method == 'PUT', **args)
+        except IntegrityError:
+            # With foreign keys enforced, the only constraint left to fail is the store.
+            await session.rollback()
+            raise APIError("Store {} does not exist.".format(args['store_id']))
+        if found is None:
+            raise APIError("An item with name '{}' already exists".format(name))
+        return JSONResponse(found, 200 if request.method == 'PUT' else 201)
+
+
+async def item_list(request):
+    """
+    GET /items, see resources.item.ItemList.
+    :param request:
+    :return:
+    """
+    args = pagination_args(request)
+    fields = fieldset_args(request, ItemModel.FIELDS)['fields']
+    sort, filters = item_filter_args(request)
+    columns, descending = ItemModel.sort_key(sort)
+    matching = select(ItemModel).where(*ItemModel.filters(**filters))
+    ordered = matching.order_by(*[column.desc() if descending else column for column in columns])
+    if args['stream']:
+        async def chunks():
+            async with new_session(request) as session:
+                result = await session.stream_scalars(ordered.execution_options(yield_per=chunk_size()))
+                async for partition in result.partitions():
+                    yield [select_fields(found.json(), fields) for found in partition]
+        return StreamingResponse(stream_json_list('items', chunks()), media_type='application/json')
+
+    async with new_session(request) as session:
+        if not args['paginate']:
+            items = (await session.execute(ordered)).scalars().all()
+            return JSONResponse({'items': [select_fields(found.json(), fields) for found in items]})
+        try:
+            statement = page_query(matching, columns, args['limit'], args['cursor'], descending)
+        except ValueError as e:
+            raise APIError(str(e))
+        items, next_cursor = page_result((await session.execute(statement)).scalars().all(), columns,
+                                         args['limit'])
+        return JSONResponse({'items': [select_fields(found.json(), fields) for found in items],
+                             'next': next_cursor})
+
+
+async def store(request):
+    """
+    GET, POST and DELETE /store/<name>, see resources.store.Store.
+    :param request:
+    :return:
+    """
+    name = request.path_params['name']
+    async with new_session(request) as session:
+        if request.method == 'GET':
+            shape = store_shape(request)
+            found = (await session.execute(select(StoreModel).options(selectinload(StoreModel.items))
+                                           .filter_by(name=name))).scalars().first()
+            if found:
+                return JSONResponse(select_store_fields(found, *shape))
+            return JSONResponse({'message': 'Store not found'}, 404)
+
+        store_id = (await session.execute(select(StoreModel.id).filter_by(name=name))).scalar()
+        if request.method == 'DELETE':
+            if store_id is not None:
+                # The items of the store are detached from it, like the ORM does in run:app.
+                await session.execute(update(ItemModel).where(ItemModel.store_id == store_id)
+                                      .values(store_id=None))
+                await session.execute(delete(StoreModel).where(StoreModel.id == store_id))
+                await bump_versions(session, ['stores', DataVersionModel.store_key(store_id)])
+                await session.commit()
+            return JSONResponse({'message': 'Store deleted'})
+
+        if store_id is not None:
+            raise APIError("A store with name '{}' already exists.".format(name))
+        created = StoreModel(name)
+        session.add(created)
+        try:
+            # Flush first, a new store has no id before that.
+            await session.flush()
+            await bump_versions(session, ['stores', DataVersionModel.store_key(created.id)])
+            await session.commit()
+        except IntegrityError:
+            # Another request created it in the meantime.
+            await session.rollback()
+            raise APIError("A store with name '{}' already exists.".format(name))
+        return JSONResponse(created.json([]), 201)
+
+
+async def store_list(request):
+    """
+    GET /stores, see resources.store.StoreList.
+    :param request:
+    :return:
+    """
+    args = pagination_args(request)
+    shape = store_shape(request)
+    with_items = select(StoreModel).options(selectinload(StoreModel.items))
+    if args['stream']:
+        async def chunks():
+            # One page of chunk_size stores and their items at a time.
+            cursor = None
+            async with new_session(request) as session:
+                while True:
+                    statement = page_query(with_items, StoreModel.id, chunk_size(), cursor)
+                    stores, cursor = page_result((await session.execute(statement)).scalars().all(),
+                                                 StoreModel.id, chunk_size())
+                    yield [select_store_fields(found, *shape) for found in stores]
+                    session.expunge_all()
+                    if cursor is None:
+                        break
+        return StreamingResponse(stream_json_list('stores', chunks()), media_type='application/json')
+
+    async with new_session(request) as session:
+        if not args['paginate']:
+            stores = (await session.execute(with_items)).scalars().all()
+            return JSONResponse({'stores': [select_store_fields(found, *shape) for found in stores]})
+        try:
+            statement = page_query(with_items, StoreModel.id, args['limit'], args['cursor'])
+        except ValueError as e:
+            raise APIError(str(e))
+        stores, next_cursor = page_result((await session.execute(statement)).scalars().all(), StoreModel.id,
+                                          args['limit'])
+        return JSONResponse({'stores': [select_store_fields(found, *shape) for found in stores],
+                             'next': next_cursor})
+
+
+async def user_register(request):
+    """
+    POST /register, see resources.user.UserRegister.
+    :param request:
+    :return:
+    """
+    args = await parse_args(request, USER_ARGUMENTS)
+    async with new_session(request) as session:
+        if (await session.execute(select(UserModel.id).filter_by(username=args['username']))).scalar():
+            raise APIError('A user with that username already exists.')
+        session.add(UserModel(**args))
+        await session.commit()
+    return JSONResponse({"message": "User created succesfully."}, 201)
+
+
+async def user(request):
+    """
+    GET and DELETE /user/<id>, see resources.user.User.
+    :param request:
+    :return:
+    """
+    async with new_session(request) as session:
+        found = await session.get(UserModel, request.path_params['user_id'])
+        if not found:
+            return JSONResponse({"message": "User not found"}, 404)
+        if request.method == 'GET':
+            return JSONResponse(found.json())
+        await session.delete(found)
+        await session.commit()
+    return JSONResponse({'message': 'User deleted.'})
+
+
+async def auth(request):
+    """
+    POST /auth, Flask-JWT's authentication endpoint.
+    :param request:
+    :return:
+    """
+    try:
+        data = json.loads(await request.body())
+    except ValueError:
+        raise APIError(BadRequest.description)
+    if not isinstance(data, dict):
+        raise JWTError('Bad Request', 'Invalid credentials')
+    username = data.get(JWT_CONFIG['JWT_AUTH_USERNAME_KEY'])
+    password = data.get(JWT_CONFIG['JWT_AUTH_PASSWORD_KEY'])
+    if not all([username, password, len(data) == 2]):
+        raise JWTError('Bad Request', 'Invalid credentials')
+
+    async with new_session(request) as session:
+        found = (await session.execute(select(UserModel).filter_by(username=username))).scalars().first()
+        if not (found and safe_str_cmp(found.password, password)):
+            raise JWTError('Bad Request', 'Invalid credentials')
+        return JSONResponse({'access_token': encode_token(found)})
+
+
+async def handle_api_error(request, error):
+    return JSONResponse({'message': error.message}, error.status_code)
+
+
+async def handle_jwt_error(request, error):
+    # Flask's jsonify sorts the keys.
+    return JSONResponse({'description': error.description,
+                         'error': error.error,
+                         'status_code': error.status_code}, error.status_code, error.headers)
+
+
+async def handle_http_error(request, error):
+    """
+    Unknown paths and methods get the messages of werkzeug, as JSON.
+    """
+    exception = default_exceptions.get(error.status_code)
+    message = exception.description if exception is not None else error.detail
+    return JSONResponse({'message': message}, error.status_code, getattr(error, 'headers', None))
+
+
+ROUTES = [
+    Route('/store/{name}', store, methods=['GET', 'POST', 'DELETE']),
+    Route('/item/{name}', item, methods=['GET', 'POST', 'PUT', 'DELETE']),
+    Route('/items', item_list, methods=['GET']),
+    Route('/stores', store_list, methods=['GET']),
+    Route('/register', user_register, methods=['POST']),
+    Route('/user/{user_id:int}', user, methods=['GET', 'DELETE']),
+    Route('/auth', auth, methods=['POST']),
+]
+
+
+def create_app(database_url=None):
+    """
+    Builds the ASGI app on database_url, by default the DATABASE_URL run:app uses.
+    It doesn't create the tables: run `flask init-db` or start run:app once first.
+    :param database_url:
+    :return:
+    """
+    engine = create_engine(database_url or os.environ.get('DATABASE_URL', 'sqlite:///data.db'))
+
+    @contextlib.asynccontextmanager
+    async def lifespan(application):
+        yield
+        await engine.dispose()
+
+    application = Starlette(routes=ROUTES,
+                            exception_handlers={APIError: handle_api_error,
+                                                JWTError: handle_jwt_error,
+                                                HTTPException: handle_http_error},
+                            lifespan=lifespan)
+    application.state.engine = engine
+    application.state.sessionmaker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    return application
+
+
+app = create_app()
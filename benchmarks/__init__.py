@@ -0,0 +1,5 @@
+"""
+BENCHMARKS
+Stand-alone performance scripts. Run them from the repository root, e.g.
+python -m benchmarks.lookup_indexes
+"""
@@ -0,0 +1,249 @@
+"""
+BENCHMARKS | ASGI LOAD
+Serves the same SQLite database with run:app under uwsgi (WORKERS processes of
+THREADS threads, as in production) and with asgi:app under uvicorn (WORKERS
+processes), then holds 100, 1k and 10k concurrent keep-alive connections
+against each and reports the throughput, the p50/p95/p99 latency and the failed
+requests. The load comes from several client processes, so the client is not
+the bottleneck before the servers are. The caches of run:app are off unless
+--wsgi-cache is set, so both servers do the same database work.
+
+    python -m benchmarks.asgi_load --connections 100 1000 10000 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.common import create_bench_app, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The servers are looked up next to the interpreter, e.g. in the virtualenv.
+BIN = os.path.dirname(sys.executable)
+ITEMS = 1000
+STORES = 10
+
+# name: (path, whether it needs a JWT)
+PATHS = {'items page': ('/items?limit=20', False),
+         'store': ('/store/store-1', False),
+         'item + JWT': ('/item/item-1', True)}
+
+
+def raise_file_limit():
+    """
+    Every connection is a file descriptor on both ends: lift the soft limit to the hard one.
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def listen_queue_limit():
+    """
+    The largest listen queue the kernel allows, uwsgi refuses to start above it.
+    :return:
+    """
+    try:
+        with open('/proc/sys/net/core/somaxconn') as somaxconn:
+            return int(somaxconn.read())
+    except (OSError, ValueError):
+        return 128
+
+
+def seed(path):
+    """
+    Creates the tables, the stores, the items and a user.
+    :param path: the database file.
+    """
+    client = create_bench_app(path).test_client()
+    for i in range(STORES):
+        client.post('/store/store-{}'.format(i))
+    client.post('/items/bulk', json=[{'name': 'item-{}'.format(i), 'price': i / 100.0,
+                                      'store_id': i % STORES + 1} for i in range(ITEMS)])
+    client.post('/register', json={'username': 'bench', 'password': 'bench'})
+
+
+def server_command(server, port, workers, threads, backlog):
+    """
+    The command line that serves the app.
+    :param server: 'uwsgi' or 'uvicorn'.
+    :param port:
+    :param workers:
+    :param threads: uwsgi threads per worker.
+    :param backlog: the listen queue of the socket.
+    :return:
+    """
+    if server == 'uwsgi':
+        return [os.path.join(BIN, 'uwsgi'), '--http-socket', ':{}'.format(port), '--http-keepalive', '--master',
+                '--module', 'run:app', '--processes', str(workers), '--threads', str(threads),
+                '--listen', str(backlog), '--die-on-term', '--disable-logging']
+    return [os.path.join(BIN, 'uvicorn'), 'asgi:app', '--port', str(port),
+            '--workers', str(workers), '--backlog', str(backlog), '--log-level', 'warning', '--no-access-log']
+
+
+def start_server(command, database, port, cache):
+    """
+    Starts a server and waits until it answers.
+    :param command:
+    :param database: the database file.
+    :param port:
+    :param cache: keep the caches of run:app on.
+    :return: the server process.
+    """
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + database, PYTHONPATH=ROOT, PYTHONWARNINGS='ignore')
+    if not cache:
+        env['CACHE_MAXSIZE'] = '0'
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get('http://127.0.0.1:{}/items?limit=1'.format(port)).status_code == 200:
+                return process
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("{} did not start.".format(command[0]))
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def hold_connections(url, headers, connections, seconds):
+    """
+    Keeps connections requests in flight on as many connections for the given time.
+    :param url:
+    :param headers:
+    :param connections:
+    :param seconds:
+    :return: the latencies (ms) of the successful requests and the number of failures.
+    """
+    latencies = []
+    failures = 0
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(limits=limits, timeout=60.0, headers=headers) as client:
+        deadline = time.perf_counter() + seconds
+
+        async def connection():
+            nonlocal failures
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                except httpx.HTTPError:
+                    failures += 1
+                    # A refused or reset connection is retried after a pause, like a client would.
+                    await asyncio.sleep(0.1)
+                    continue
+                end = time.perf_counter()
+                if end > deadline:
+                    # Finished after the measured window, the throughput would be overstated.
+                    break
+                if response.status_code == 200:
+                    latencies.append((end - start) * 1000)
+                else:
+                    failures += 1
+
+        await asyncio.gather(*[connection() for _ in range(connections)])
+    return latencies, failures
+
+
+def client_process(args):
+    """
+    Runs hold_connections() in a client process.
+    :param args: a (url, headers, connections, seconds) tuple.
+    :return:
+    """
+    raise_file_limit()
+    return asyncio.run(hold_connections(*args))
+
+
+def run_load(url, headers, connections, seconds, clients):
+    """
+    Spreads connections over clients processes.
+    :param url:
+    :param headers:
+    :param connections:
+    :param seconds:
+    :param clients:
+    :return:
+    """
+    clients = min(clients, connections)
+    shares = [connections // clients + (1 if i < connections % clients else 0) for i in range(clients)]
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(client_process, [(url, headers, share, seconds) for share in shares])
+    latencies = [latency for result, _ in results for latency in result]
+    return {'requests_per_second': len(latencies) / seconds,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'failures': sum(failures for _, failures in results)}
+
+
+def token(port):
+    """
+    A JWT of the benchmark user, from /auth.
+    :param port:
+    :return:
+    """
+    response = httpx.post('http://127.0.0.1:{}/auth'.format(port), json={'username': 'bench', 'password': 'bench'})
+    return response.json()['access_token']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=4, help='server processes')
+    parser.add_argument('--threads', type=int, default=8, help='threads per uwsgi process')
+    parser.add_argument('--clients', type=int, default=os.cpu_count(), help='load generator processes')
+    parser.add_argument('--paths', nargs='+', choices=sorted(PATHS), default=sorted(PATHS))
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--wsgi-cache', action='store_true', help='keep the caches of run:app on')
+    args = parser.parse_args()
+
+    raise_file_limit()
+    max_backlog = listen_queue_limit()
+    database = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    seed(database)
+
+    results = {}
+    for server in ('uwsgi', 'uvicorn'):
+        for connections in args.connections:
+            command = server_command(server, args.port, args.workers, args.threads, min(connections, max_backlog))
+            process = start_server(command, database, args.port, args.wsgi_cache)
+            try:
+                auth = {'Authorization': 'JWT ' + token(args.port)}
+                for name in args.paths:
+                    path, needs_token = PATHS[name]
+                    results[server, connections, name] = run_load(
+                        'http://127.0.0.1:{}{}'.format(args.port, path), auth if needs_token else {},
+                        connections, args.seconds, args.clients)
+            finally:
+                stop_server(process)
+
+    print('{:>8} {:>12} {:>11} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+        'server', 'path', 'connections', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'failures'))
+    for (server, connections, name), result in sorted(results.items(), key=lambda entry: (entry[0][2], entry[0][1])):
+        print('{:>8} {:>12} {:>11} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9}'.format(
+            server, name, connections, result['requests_per_second'], result['p50'], result['p95'],
+            result['p99'], result['failures']))
+    print(json.dumps({'{} {} {}'.format(*key): value for key, value in results.items()}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+BENCHMARKS | BULK ITEMS
+Compares loading items with one PUT /item/<name> per item against a single
+POST /items/bulk, both for new items and for updates of existing ones.
+
+    python -m benchmarks.bulk_items --sizes 1000 10000 50000
+"""
+import argparse
+import sys
+import time
+
+from benchmarks.common import create_bench_app
+from db import db
+
+
+def reset(app, client):
+    """
+    Recreates the tables with a single store.
+    :param app:
+    :param client:
+    """
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    client.post('/store/bench')
+
+
+def one_by_one(client, rows):
+    """
+    Sends one PUT per item.
+    :param client:
+    :param rows:
+    """
+    for row in rows:
+        response = client.put('/item/' + row['name'], json={'price': row['price'],
+                                                             'store_id': row['store_id']})
+        assert response.status_code == 200, response.status_code
+
+
+def bulk(client, rows):
+    """
+    Sends every item in one POST /items/bulk.
+    :param client:
+    :param rows:
+    """
+    response = client.post('/items/bulk', json=rows)
+    assert response.status_code == 200 and response.json['errors'] == 0, response.json
+
+
+def timed(func, *args):
+    """
+    Returns how long func(*args) took, in seconds.
+    :return:
+    """
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    args = parser.parse_args()
+
+    app = create_bench_app()
+    client = app.test_client()
+    print('{:>7} {:<7} {:>12} {:>12} {:>9}'.format('items', 'kind', 'PUT each', 'bulk', 'speedup'))
+    for size in args.sizes:
+        rows = [{'name': 'item-{}'.format(i), 'price': i / 100.0, 'store_id': 1} for i in range(size)]
+        updates = [dict(row, price=row['price'] + 1) for row in rows]
+        reset(app, client)
+        single_insert = timed(one_by_one, client, rows)
+        single_update = timed(one_by_one, client, updates)
+        reset(app, client)
+        bulk_insert = timed(bulk, client, rows)
+        bulk_update = timed(bulk, client, updates)
+        for kind, single, batched in (('insert', single_insert, bulk_insert),
+                                      ('update', single_update, bulk_update)):
+            print('{:>7} {:<7} {:>11.2f}s {:>11.2f}s {:>8.1f}x'.format(
+                size, kind, single, batched, single / batched))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+BENCHMARKS | COMMON
+Helpers shared by the benchmark scripts.
+"""
+import os
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from app import create_app
+from db import init_db
+
+
+def percentile(samples, pct):
+    """
+    Returns the pct-th percentile of samples (nearest-rank).
+    :param samples: a list of numbers.
+    :param pct: the percentile, between 0 and 100.
+    :return:
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def measure(func, args_list):
+    """
+    Calls func once per entry in args_list and records every call's latency.
+    :param func: the callable to time.
+    :param args_list: a list of argument tuples.
+    :return: a list of latencies in milliseconds.
+    """
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summarize(latencies):
+    """
+    Reduces a list of latencies (ms) to the usual statistics.
+    :param latencies:
+    :return:
+    """
+    return {'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'mean': sum(latencies) / len(latencies) if latencies else 0.0}
+
+
+class QueryCounter:
+    """
+    Context manager that counts the statements executed on an engine.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+def create_bench_app(path=None, config=None):
+    """
+    Creates an app with its tables on a SQLite database, see app.create_app().
+    :param path: the database file, a new temporary one by default.
+    :param config: more config keys.
+    :return:
+    """
+    path = path or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = create_app(dict(config or {}, SQLALCHEMY_DATABASE_URI='sqlite:///' + path))
+    init_db(app)
+    return app
@@ -0,0 +1,303 @@
+"""
+BENCHMARKS | ENDPOINTS
+Seeds a database at several sizes and drives every resource of the app through
+the Flask test client. Reports p50/p95/p99 latency, throughput and queries per
+request, saves them as a JSON baseline, and fails when a run regresses past it.
+
+    python -m benchmarks.endpoints --sizes 1000 100000 1000000 --save
+    python -m benchmarks.endpoints --sizes 1000 100000 1000000 --threshold 0.25 --metrics p50 p95
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from benchmarks.common import QueryCounter, create_bench_app, summarize
+from cache import app_caches
+from db import db, create_missing_indexes
+from models.item import ItemModel
+from models.store import StoreModel
+from pagination import encode_cursor
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+SEED_CHUNK_SIZE = 50000
+BULK_ROWS = 100
+
+
+def seed(size, stores):
+    """
+    Recreates the tables with size items spread over stores stores.
+    :param size:
+    :param stores:
+    """
+    db.drop_all()
+    db.create_all()
+    create_missing_indexes()
+    db.session.execute(StoreModel.__table__.insert(),
+                       [{'id': i, 'name': 'store-{}'.format(i)} for i in range(1, stores + 1)])
+    for start in range(0, size, SEED_CHUNK_SIZE):
+        db.session.execute(ItemModel.__table__.insert(),
+                           [{'name': 'item-{}'.format(i), 'price': i / 100.0, 'store_id': i % stores + 1}
+                            for i in range(start, min(start + SEED_CHUNK_SIZE, size))])
+    db.session.commit()
+    for cache in app_caches().values():
+        cache.clear()
+
+
+def expect(response, *statuses):
+    """
+    Fails the run when a request doesn't return one of statuses.
+    :param response:
+    :param statuses:
+    """
+    assert response.status_code in statuses, (response.status_code, response.get_data()[:200])
+
+
+class Scenario:
+    """
+    One kind of request, sent with a different argument for every repetition.
+    """
+
+    def __init__(self, name, send, max_requests=None):
+        """
+        :param name: e.g. 'GET /item/<name>'.
+        :param send: a callable taking the client, the benchmark state and the index of
+            the repetition, which sends one request and checks its status.
+        :param max_requests: caps the repetitions of requests whose cost grows with the
+            size of the database.
+        """
+        self.name = name
+        self.send = send
+        self.max_requests = max_requests
+
+
+def item_name(state):
+    """
+    A random seeded item.
+    :param state:
+    :return:
+    """
+    return 'item-{}'.format(state['random'].randrange(state['size']))
+
+
+def store_name(state):
+    """
+    A random seeded store.
+    :param state:
+    :return:
+    """
+    return 'store-{}'.format(state['random'].randint(1, state['stores']))
+
+
+def bulk_rows(state):
+    """
+    BULK_ROWS updates of distinct random items.
+    :param state:
+    :return:
+    """
+    names = state['random'].sample(range(state['size']), min(BULK_ROWS, state['size']))
+    return [{'name': 'item-{}'.format(name), 'price': 3.0, 'store_id': 1} for name in names]
+
+
+def user_id(i):
+    """
+    The id of the user POST /register created in repetition i: the tables are recreated
+    for every size and prepare() registers the first user.
+    :param i:
+    :return:
+    """
+    return i + 2
+
+
+SCENARIOS = [
+    Scenario('POST /register', lambda client, state, i: expect(
+        client.post('/register', json={'username': 'bench-{}'.format(i), 'password': 'pw'}), 201)),
+    Scenario('POST /auth', lambda client, state, i: expect(
+        client.post('/auth', json={'username': 'bench-{}'.format(i), 'password': 'pw'}), 200)),
+    Scenario('GET /user/<id>', lambda client, state, i: expect(
+        client.get('/user/{}'.format(user_id(i))), 200)),
+    Scenario('GET /item/<name>', lambda client, state, i: expect(
+        client.get('/item/' + item_name(state), headers=state['auth']), 200)),
+    Scenario('POST /item/<name>', lambda client, state, i: expect(
+        client.post('/item/new-{}'.format(i), json={'price': 1.0, 'store_id': 1}), 201)),
+    Scenario('PUT /item/<name>', lambda client, state, i: expect(
+        client.put('/item/' + item_name(state), json={'price': 2.0, 'store_id': 1}), 200)),
+    Scenario('DELETE /item/<name>', lambda client, state, i: expect(
+        client.delete('/item/new-{}'.format(i)), 200)),
+    Scenario('POST /items/bulk', lambda client, state, i: expect(
+        client.post('/items/bulk', json=bulk_rows(state)), 200)),
+    Scenario('GET /items', lambda client, state, i: expect(client.get('/items'), 200)),
+    Scenario('GET /items?cursor', lambda client, state, i: expect(
+        client.get('/items', query_string={'cursor': state['cursors'][i % len(state['cursors'])]}), 200)),
+    Scenario('GET /items?store_id&price', lambda client, state, i: expect(
+        client.get('/items', query_string={'store_id': 1, 'min_price': 10, 'max_price': 100, 'sort': '-price'}), 200)),
+    Scenario('GET /items?fields=name', lambda client, state, i: expect(
+        client.get('/items', query_string={'fields': 'name'}), 200)),
+    Scenario('GET /store/<name>', lambda client, state, i: expect(
+        client.get('/store/' + store_name(state)), 200)),
+    Scenario('GET /store/<name>?embed=none', lambda client, state, i: expect(
+        client.get('/store/' + store_name(state), query_string={'embed': 'none'}), 200)),
+    Scenario('POST /store/<name>', lambda client, state, i: expect(
+        client.post('/store/bench-{}'.format(i)), 201)),
+    Scenario('DELETE /store/<name>', lambda client, state, i: expect(
+        client.delete('/store/bench-{}'.format(i)), 200)),
+    # Every page of stores embeds all of their items, i.e. the whole table with 100 stores.
+    Scenario('GET /stores', lambda client, state, i: expect(client.get('/stores'), 200), max_requests=10),
+    Scenario('GET /stores?fields=name,items.name', lambda client, state, i: expect(
+        client.get('/stores', query_string={'fields': 'name,items.name'}), 200), max_requests=10),
+    Scenario('GET /store/<name>/summary', lambda client, state, i: expect(
+        client.get('/store/{}/summary'.format(store_name(state))), 200)),
+    Scenario('GET /stores/summary', lambda client, state, i: expect(client.get('/stores/summary'), 200)),
+    Scenario('DELETE /user/<id>', lambda client, state, i: expect(
+        client.delete('/user/{}'.format(user_id(i))), 200)),
+    Scenario('GET /stats', lambda client, state, i: expect(client.get('/stats'), 200)),
+]
+
+
+def prepare(client, state):
+    """
+    Fills in what the scenarios need once the database is seeded: a JWT and cursors
+    spread over the whole list of items.
+    :param client:
+    :param state:
+    """
+    expect(client.post('/register', json={'username': 'bench', 'password': 'pw'}), 201)
+    token = client.post('/auth', json={'username': 'bench', 'password': 'pw'}).json['access_token']
+    state['auth'] = {'Authorization': 'JWT ' + token}
+    step = max(state['size'] // 20, 1)
+    ids = db.session.query(ItemModel.id).filter(ItemModel.id % step == 0).order_by(ItemModel.id).limit(20)
+    state['cursors'] = [encode_cursor(row.id) for row in ids]
+
+
+def run_scenario(client, state, scenario, requests):
+    """
+    Sends requests requests of scenario.
+    :param client:
+    :param state:
+    :param scenario:
+    :param requests:
+    :return: the latency summary, throughput and queries per request.
+    """
+    requests = min(requests, scenario.max_requests or requests)
+    latencies = []
+    with QueryCounter(db.engine) as counter:
+        start = time.perf_counter()
+        for i in range(requests):
+            request_start = time.perf_counter()
+            scenario.send(client, state, i)
+            latencies.append((time.perf_counter() - request_start) * 1000)
+        elapsed = time.perf_counter() - start
+    result = summarize(latencies)
+    result['throughput'] = requests / elapsed
+    result['queries'] = counter.count / float(requests)
+    return result
+
+
+def run(sizes, stores, requests):
+    """
+    Runs every scenario at every size.
+    :param sizes:
+    :param stores:
+    :param requests: the number of requests per scenario.
+    :return: the results keyed by size, then by scenario.
+    """
+    app = create_bench_app()
+    client = app.test_client()
+    # Keep the one-off costs of the first request out of the measurements.
+    client.get('/stores')
+    results = {}
+    with app.app_context():
+        for size in sizes:
+            start = time.perf_counter()
+            seed(size, stores)
+            print('{} items in {} stores seeded in {:.1f}s'.format(size, stores, time.perf_counter() - start))
+            state = {'size': size, 'stores': stores, 'random': random.Random(size)}
+            prepare(client, state)
+            results[str(size)] = {}
+            for scenario in SCENARIOS:
+                results[str(size)][scenario.name] = run_scenario(client, state, scenario, requests)
+                db.session.remove()
+            report(size, results[str(size)])
+    return results
+
+
+def report(size, results):
+    """
+    Prints the results of one size.
+    :param size:
+    :param results:
+    """
+    print('{:>24} {:>9} {:>9} {:>9} {:>10} {:>8}'.format(
+        '{} items'.format(size), 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries'))
+    for name, result in results.items():
+        print('{:>24} {:>9.2f} {:>9.2f} {:>9.2f} {:>10.1f} {:>8.1f}'.format(
+            name, result['p50'], result['p95'], result['p99'], result['throughput'], result['queries']))
+
+
+def regressions(results, baseline, metrics, threshold, min_delta):
+    """
+    Compares results with a saved baseline.
+    :param results:
+    :param baseline:
+    :param metrics: the latency percentiles to check, e.g. ['p50', 'p95'].
+    :param threshold: the allowed relative slowdown, e.g. 0.2 for 20%.
+    :param min_delta: slowdowns smaller than this many milliseconds are ignored as noise.
+    :return: a list of messages, empty when nothing regressed.
+    """
+    messages = []
+    for size, scenarios in results.items():
+        for name, result in scenarios.items():
+            base = baseline.get('results', {}).get(size, {}).get(name)
+            if base is None:
+                continue
+            if result['queries'] > base['queries']:
+                messages.append('{} items, {}: {:.1f} queries per request, baseline {:.1f}'.format(
+                    size, name, result['queries'], base['queries']))
+            for metric in metrics:
+                if result[metric] > base[metric] * (1 + threshold) and result[metric] - base[metric] > min_delta:
+                    messages.append('{} items, {}: {} {:.2f}ms, baseline {:.2f}ms'.format(
+                        size, name, metric, result[metric], base[metric]))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000])
+    parser.add_argument('--stores', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed relative slowdown')
+    # p95/p99 of a few hundred requests are too noisy to gate on by default.
+    parser.add_argument('--metrics', nargs='+', default=['p50'], choices=['p50', 'p95', 'p99', 'mean'])
+    parser.add_argument('--min-delta', type=float, default=1.0, help='ignored slowdown, in ms')
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.stores, args.requests)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'requests': args.requests, 'stores': args.stores, 'results': results},
+                      f, indent=2, sort_keys=True)
+        print('Baseline saved to {}'.format(args.baseline))
+        return 0
+    if not os.path.exists(args.baseline):
+        print('No baseline at {}, run with --save first.'.format(args.baseline))
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    messages = regressions(results, baseline, args.metrics, args.threshold, args.min_delta)
+    for message in messages:
+        print('REGRESSION: ' + message)
+    if messages:
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+BENCHMARKS | JSON ENCODING
+Times every encoder in representations.ENCODERS on /items and /stores shaped
+payloads of several sizes, and checks that they all encode the same content.
+
+    python -m benchmarks.json_encoding --sizes 10 1000 100000
+"""
+import argparse
+import json
+import time
+
+from representations import ENCODERS
+
+STORES = 100
+
+
+def items_payload(size):
+    """
+    A /items?paginate=false response body with size items.
+    :param size:
+    :return:
+    """
+    return {'items': [{'id': i, 'name': 'item-{}'.format(i), 'price': i / 100.0,
+                       'store_id': i % STORES + 1} for i in range(size)]}
+
+
+def stores_payload(size):
+    """
+    A /stores?paginate=false response body with size items spread over the stores.
+    :param size:
+    :return:
+    """
+    items = items_payload(size)['items']
+    return {'stores': [{'id': s, 'name': 'store-{}'.format(s),
+                        'items': [item for item in items if item['store_id'] == s]}
+                       for s in range(1, STORES + 1)]}
+
+
+def best_of(func, data, repeat):
+    """
+    Returns the fastest of repeat calls to func(data), in milliseconds.
+    :return:
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    names = sorted(ENCODERS)
+    print('{:>8} {:<8} {:>10} '.format('items', 'payload', 'body KB') +
+          ' '.join('{:>12}'.format(name) for name in names))
+    for size in args.sizes:
+        for payload_name, payload in (('items', items_payload(size)), ('stores', stores_payload(size))):
+            bodies = {name: ENCODERS[name](payload) for name in names}
+            assert all(json.loads(body) == payload for body in bodies.values())
+            timings = [best_of(ENCODERS[name], payload, args.repeat) for name in names]
+            print('{:>8} {:<8} {:>10.1f} '.format(size, payload_name, len(bodies['json']) / 1024.0) +
+                  ' '.join('{:>10.3f}ms'.format(timing) for timing in timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+BENCHMARKS | LOOKUP INDEXES
+Measures find_by_name/find_by_username style lookups before and after the
+lookup indexes are created.
+
+    python -m benchmarks.lookup_indexes --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import tempfile
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import Session
+
+from db import db, create_missing_indexes
+from models.item import ItemModel
+from models.store import StoreModel
+from models.user import UserModel
+from benchmarks.common import measure, summarize
+
+
+def seed(engine, size):
+    """
+    Fills the stores, items and users tables with size rows each.
+    :param engine:
+    :param size:
+    """
+    db.Model.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(StoreModel.__table__.insert(),
+                           [{'id': i, 'name': 'store-{}'.format(i)} for i in range(1, size + 1)])
+        connection.execute(ItemModel.__table__.insert(),
+                           [{'name': 'item-{}'.format(i), 'price': i / 100.0,
+                             'store_id': i % size + 1} for i in range(1, size + 1)])
+        connection.execute(UserModel.__table__.insert(),
+                           [{'username': 'user-{}'.format(i), 'password': 'x'}
+                            for i in range(1, size + 1)])
+
+
+def drop_indexes(engine):
+    """
+    Drops every index the models declare, to emulate a database created before they existed.
+    :param engine:
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in db.Model.metadata.sorted_tables:
+            for index in inspector.get_indexes(table.name):
+                connection.exec_driver_sql('DROP INDEX {}'.format(index['name']))
+
+
+def run_lookups(engine, size, lookups):
+    """
+    Times random lookups by name on every table.
+    :param engine:
+    :param size:
+    :param lookups: the number of lookups per table.
+    :return: a dict of latency summaries keyed by lookup.
+    """
+    keys = [(random.randint(1, size),) for _ in range(lookups)]
+    session = Session(engine)
+    results = {
+        'ItemModel.find_by_name': measure(
+            lambda i: session.query(ItemModel).filter_by(name='item-{}'.format(i)).first(), keys),
+        'StoreModel.find_by_name': measure(
+            lambda i: session.query(StoreModel).filter_by(name='store-{}'.format(i)).first(), keys),
+        'UserModel.find_by_username': measure(
+            lambda i: session.query(UserModel).filter_by(username='user-{}'.format(i)).first(), keys),
+    }
+    session.close()
+    return {name: summarize(latencies) for name, latencies in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    print('{:>9} {:<28} {:>12} {:>12} {:>9}'.format(
+        'rows', 'lookup', 'before p50', 'after p50', 'speedup'))
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine('sqlite:///' + os.path.join(directory, 'bench.db'))
+            seed(engine, size)
+            drop_indexes(engine)
+            before = run_lookups(engine, size, args.lookups)
+            create_missing_indexes(engine)
+            after = run_lookups(engine, size, args.lookups)
+            engine.dispose()
+
+        for lookup in before:
+            slow, fast = before[lookup]['p50'], after[lookup]['p50']
+            print('{:>9} {:<28} {:>10.3f}ms {:>10.3f}ms {:>8.1f}x'.format(
+                size, lookup, slow, fast, slow / fast if fast else float('inf')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+BENCHMARKS | QUERY COUNTS
+Checks that /stores and /store/<name> issue the same number of queries whatever
+the number of stores and items. Exits with a non-zero status when they don't.
+
+    python -m benchmarks.query_counts
+"""
+import sys
+
+from benchmarks.common import QueryCounter, create_bench_app
+from cache import app_caches
+from db import db
+from models.item import ItemModel
+from models.store import StoreModel
+
+
+def seed(stores, items_per_store):
+    """
+    Recreates the tables with the given number of stores and items.
+    :param stores:
+    :param items_per_store:
+    """
+    db.drop_all()
+    db.create_all()
+    db.session.execute(StoreModel.__table__.insert(),
+                       [{'id': i, 'name': 'store-{}'.format(i)} for i in range(1, stores + 1)])
+    db.session.execute(ItemModel.__table__.insert(),
+                       [{'name': 'item-{}-{}'.format(s, i), 'price': 1.0, 'store_id': s}
+                        for s in range(1, stores + 1) for i in range(items_per_store)])
+    db.session.commit()
+    # The raw inserts don't bump the data versions, so entries of the previous seed would still match.
+    for cache in app_caches().values():
+        cache.clear()
+
+
+def count_queries(client, path):
+    """
+    Returns the number of queries a GET on path executes.
+    :param client:
+    :param path:
+    :return:
+    """
+    with QueryCounter(db.engine) as counter:
+        response = client.get(path)
+    assert response.status_code == 200, response.status_code
+    return counter.count
+
+
+def main():
+    app = create_bench_app()
+    client = app.test_client()
+    # Keep the one-off costs of the first request out of the measurements.
+    client.get('/stores')
+    counts = {}
+    with app.app_context():
+        for stores in (1, 10, 1000):
+            seed(stores, 3)
+            counts[stores] = {'/stores': count_queries(client, '/stores'),
+                              '/stores?paginate=false': count_queries(client, '/stores?paginate=false'),
+                              '/store/<name>': count_queries(client, '/store/store-1')}
+            print('{:>5} stores: {}'.format(stores, counts[stores]))
+
+    if len({tuple(sorted(c.items())) for c in counts.values()}) != 1:
+        print('FAIL: the query count depends on the number of stores')
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
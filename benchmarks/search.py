@@ -0,0 +1,114 @@
+"""
+BENCHMARKS | SEARCH
+Seeds a SQLite database with 1M items and times GET /items/search through the
+FTS5 trigram index, then on a copy of the database without it, where searches
+fall back to LIKE. Also reports what the index triggers add to item writes.
+
+    python -m benchmarks.search --size 1000000 --requests 50
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+
+from app import create_app
+from benchmarks.common import create_bench_app, measure, summarize
+from db import db
+from models.item import ItemModel
+from models.store import StoreModel
+from search import SEARCH_TABLE, search_strategy
+
+SEED_CHUNK_SIZE = 50000
+
+# name: (q, whether to ask for the second page)
+QUERIES = {'exact name': ('item-123456', False),
+           'substring': ('23456', False),
+           'prefix, 111 matches': ('item-1234', False),
+           'broad, 111k matches': ('item-1', False),
+           'broad, page 2': ('item-1', True),
+           'short (LIKE)': ('-7', False),
+           'no match': ('zzz', False)}
+
+
+def seed(app, size):
+    """
+    Fills the items table, through the search index triggers.
+    :param app:
+    :param size:
+    """
+    with app.app_context():
+        db.session.execute(StoreModel.__table__.insert(), [{'id': 1, 'name': 'store-1'}])
+        for start in range(0, size, SEED_CHUNK_SIZE):
+            db.session.execute(ItemModel.__table__.insert(),
+                               [{'name': 'item-{}'.format(i), 'price': i / 100.0, 'store_id': 1}
+                                for i in range(start, min(start + SEED_CHUNK_SIZE, size))])
+        db.session.commit()
+
+
+def copy_without_index(path):
+    """
+    Copies the database and drops the search table and its triggers from the copy.
+    :param path:
+    :return: the path of the copy.
+    """
+    copy = path + '.like'
+    source, target = sqlite3.connect(path), sqlite3.connect(copy)
+    source.backup(target)
+    source.close()
+    for trigger in ('items_search_insert', 'items_search_delete', 'items_search_update'):
+        target.execute('DROP TRIGGER {}'.format(trigger))
+    target.execute('DROP TABLE {}'.format(SEARCH_TABLE))
+    target.execute('VACUUM')
+    target.close()
+    return copy
+
+
+def run(app, requests):
+    """
+    Times every query of QUERIES and item writes.
+    :param app:
+    :param requests: the repetitions per query.
+    :return: the strategy, and a dict of (latency summary, result count) by query.
+    """
+    client = app.test_client()
+    with app.app_context():
+        strategy = search_strategy(db.engine)
+    results = {}
+    for name, (term, second_page) in QUERIES.items():
+        query = {'q': term, 'limit': 20}
+        if second_page:
+            query['cursor'] = client.get('/items/search', query_string=query).get_json()['next']
+        count = len(client.get('/items/search', query_string=query).get_json()['items'])
+        latencies = measure(lambda: client.get('/items/search', query_string=query), [()] * requests)
+        results[name] = (summarize(latencies), count)
+    latencies = measure(lambda i: client.put('/item/new-{}'.format(i), json={'price': 1.0, 'store_id': 1}),
+                        [(i,) for i in range(requests)])
+    results['PUT /item (write)'] = (summarize(latencies), None)
+    return strategy, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    # The caches would hide the cost of the queries, the slow query log would flood the output.
+    config = {'CACHE_MAXSIZE': 0, 'SLOW_QUERY_MS': 0}
+    seed(create_bench_app(path, config), args.size)
+    copy = copy_without_index(path)
+
+    print('{} items'.format(args.size))
+    print('{:>8} {:>22} {:>8} {:>9} {:>9}'.format('strategy', 'query', 'results', 'p50 ms', 'p95 ms'))
+    # init_db() would create the index again, the copy already has its tables.
+    for app in (create_app(dict(config, SQLALCHEMY_DATABASE_URI='sqlite:///' + path)),
+                create_app(dict(config, SQLALCHEMY_DATABASE_URI='sqlite:///' + copy))):
+        strategy, results = run(app, args.requests)
+        for name, (summary, count) in results.items():
+            print('{:>8} {:>22} {:>8} {:>9.2f} {:>9.2f}'.format(
+                strategy, name, '' if count is None else count, summary['p50'], summary['p95']))
+
+
+if __name__ == '__main__':
+    main()
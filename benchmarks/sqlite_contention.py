@@ -0,0 +1,128 @@
+"""
+BENCHMARKS | SQLITE CONTENTION
+Runs several reader and writer processes against one SQLite file, like uwsgi
+workers, with and without the SQLite profile from db.SQLITE_PRAGMAS, and
+reports the throughput and the number of "database is locked" failures.
+
+    python -m benchmarks.sqlite_contention --readers 4 --writers 4 --seconds 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import create_bench_app
+from db import SQLITE_PRAGMAS
+
+ITEMS = 1000
+
+
+def profile_config(profile):
+    """
+    The config of a profile: 'default' turns every pragma of db.SQLITE_PRAGMAS off.
+    :param profile: 'tuned' or 'default'.
+    :return:
+    """
+    if profile == 'default':
+        return {key: None for key in SQLITE_PRAGMAS}
+    return {}
+
+
+def child(path, profile, role, seconds):
+    """
+    Sends GET /items (reader) or PUT /item/<name> (writer) requests for
+    the given number of seconds and prints the outcome as JSON.
+    :param path: the database file.
+    :param profile: 'tuned' or 'default'.
+    :param role: 'reader' or 'writer'.
+    :param seconds:
+    """
+    client = create_bench_app(path, profile_config(profile)).test_client()
+    ok = locked = 0
+    i = 0
+    deadline = time.perf_counter() + float(seconds)
+    while time.perf_counter() < deadline:
+        i += 1
+        name = 'item-{}'.format(i % ITEMS)
+        try:
+            if role == 'writer':
+                client.put('/item/' + name, json={'price': i / 100.0, 'store_id': 1})
+            else:
+                client.get('/items?limit=50')
+            ok += 1
+        except Exception as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+    print(json.dumps({'ok': ok, 'locked': locked}))
+
+
+SEED_SCRIPT = '''
+import sys
+from benchmarks.common import create_bench_app
+from benchmarks.sqlite_contention import profile_config
+client = create_bench_app(sys.argv[1], profile_config(sys.argv[2])).test_client()
+client.post('/store/bench')
+client.post('/items/bulk', json=[{'name': 'item-{}'.format(i), 'price': 1.0, 'store_id': 1}
+                                 for i in range(int(sys.argv[3]))])
+'''
+
+
+def seed(path, profile):
+    """
+    Creates the database with one store and ITEMS items.
+    :param path:
+    :param profile:
+    """
+    subprocess.check_call([sys.executable, '-c', SEED_SCRIPT, path, profile, str(ITEMS)],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run(profile, readers, writers, seconds):
+    """
+    Runs the reader and writer processes concurrently against a fresh database.
+    :return: the summed outcomes by role.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        seed(path, profile)
+        processes = [(role, subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.sqlite_contention', '--child', path, profile, role,
+             str(seconds)], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL))
+            for role in ['reader'] * readers + ['writer'] * writers]
+        totals = {'reader': {'ok': 0, 'locked': 0}, 'writer': {'ok': 0, 'locked': 0}}
+        for role, process in processes:
+            output, _ = process.communicate()
+            lines = output.decode().strip().splitlines()
+            if process.returncode or not lines:
+                raise RuntimeError('A {} process failed.'.format(role))
+            for key, value in json.loads(lines[-1]).items():
+                totals[role][key] += value
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--child', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    print('{:<8} {:>12} {:>12} {:>14} {:>14}'.format(
+        'profile', 'reads/s', 'writes/s', 'locked reads', 'locked writes'))
+    for profile in ('default', 'tuned'):
+        totals = run(profile, args.readers, args.writers, args.seconds)
+        print('{:<8} {:>12.0f} {:>12.0f} {:>14} {:>14}'.format(
+            profile, totals['reader']['ok'] / args.seconds, totals['writer']['ok'] / args.seconds,
+            totals['reader']['locked'], totals['writer']['locked']))
+
+
+if __name__ == '__main__':
+    main()
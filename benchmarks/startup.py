@@ -0,0 +1,145 @@
+"""
+BENCHMARKS | STARTUP
+Times the start of a worker in fresh interpreters, phase by phase, against a
+database whose schema already exists, like after a deploy or a worker recycle:
+importing app.py, create_app(), init_db(), warm_up() and the first requests.
+With uwsgi lazy-apps every worker pays for all of them; without it, the master
+pays once and the workers only redo the warm-up. The cost of creating another
+app in the same interpreter, as a test suite would, is reported last.
+
+The eager layout the factory replaced is measured too: every worker imported
+the app, and its first request ran the schema check (before_first_request),
+with nothing warmed up. Isolated apps each needed a fresh interpreter. The
+savings of both are printed at the end.
+
+    python -m benchmarks.startup --runs 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.common import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the fresh interpreter, prints the timings in milliseconds as JSON.
+CHILD = '''
+import json, sys, time
+
+timings = {}
+start = time.perf_counter()
+import app
+timings['import app'] = time.perf_counter() - start
+
+start = time.perf_counter()
+application = app.create_app()
+timings['create_app'] = time.perf_counter() - start
+
+start = time.perf_counter()
+app.init_db(application)
+timings['init_db'] = time.perf_counter() - start
+
+start = time.perf_counter()
+app.warm_up(application)
+timings['warm_up'] = time.perf_counter() - start
+
+client = application.test_client()
+for name, path in (('first request', '/items?limit=10'), ('second request', '/items?limit=10'),
+                   ('first /store', '/store/missing')):
+    start = time.perf_counter()
+    response = client.get(path)
+    timings[name] = time.perf_counter() - start
+    assert response.status_code in (200, 404), response.status_code
+
+# What every further isolated app costs a test suite that builds one per test.
+start = time.perf_counter()
+for _ in range(int(sys.argv[1])):
+    app.create_app()
+timings['create_app again'] = (time.perf_counter() - start) / int(sys.argv[1])
+
+print(json.dumps({name: seconds * 1000 for name, seconds in timings.items()}))
+'''
+
+
+# The eager layout: the app is built on import, the schema checked by the first request.
+EAGER_CHILD = '''
+import json, time
+
+timings = {}
+start = time.perf_counter()
+import app
+application = app.create_app()
+timings['import app'] = time.perf_counter() - start
+
+client = application.test_client()
+start = time.perf_counter()
+app.init_db(application)
+response = client.get('/items?limit=10')
+timings['first request'] = time.perf_counter() - start
+assert response.status_code == 200, response.status_code
+
+print(json.dumps({name: seconds * 1000 for name, seconds in timings.items()}))
+'''
+
+
+def start_worker(database, apps, child=CHILD):
+    """
+    Starts the app in a fresh interpreter.
+    :param database: the path of the SQLite database.
+    :param apps: the number of apps created again in the same interpreter.
+    :param child: the script to run, CHILD or EAGER_CHILD.
+    :return: the timings of the phases, in milliseconds.
+    """
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + database, PYTHONPATH=ROOT)
+    output = subprocess.run([sys.executable, '-W', 'ignore', '-c', child, str(apps)], cwd=ROOT, env=env,
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def median(runs, *phases):
+    """
+    Returns the median over runs of the sum of the given phases.
+    :param runs: a list of timings returned by start_worker().
+    :param phases:
+    :return:
+    """
+    return percentile([sum(run[phase] for phase in phases) for run in runs], 50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--apps', type=int, default=20, help='apps created again per run')
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    # The first start creates the schema, the measured ones find it.
+    start_worker(database, 1)
+    runs = [start_worker(database, args.apps) for _ in range(args.runs)]
+    eager_runs = [start_worker(database, 0, EAGER_CHILD) for _ in range(args.runs)]
+
+    print('{:>16} {:>9} {:>9}'.format('phase', 'p50 ms', 'max ms'))
+    for phase in runs[0]:
+        samples = [run[phase] for run in runs]
+        print('{:>16} {:>9.2f} {:>9.2f}'.format(phase, percentile(samples, 50), max(samples)))
+
+    # Until a worker has served its first request, by layout.
+    eager = median(eager_runs, 'import app', 'first request')
+    comparisons = (
+        ('lazy-apps worker', eager,
+         median(runs, 'import app', 'create_app', 'init_db', 'warm_up', 'first request')),
+        ('forked worker', eager, median(runs, 'warm_up', 'first request')),
+        ('first request', median(eager_runs, 'first request'), median(runs, 'first request')),
+        ('isolated app', median(eager_runs, 'import app'), median(runs, 'create_app again')),
+    )
+    print()
+    print('{:>16} {:>9} {:>9} {:>9}'.format('', 'eager ms', 'now ms', 'saved ms'))
+    for name, before, after in comparisons:
+        print('{:>16} {:>9.2f} {:>9.2f} {:>9.2f}'.format(name, before, after, before - after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+BENCHMARKS | STREAMING MEMORY
+Compares the peak RSS of a worker serving /items and /stores buffered
+(?paginate=false) and streamed (?stream=true) at several table sizes.
+Each measurement runs in a fresh process so peaks don't carry over.
+
+    python -m benchmarks.streaming_memory --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from sqlalchemy import create_engine
+
+from benchmarks.common import create_bench_app
+from db import db
+from models.item import ItemModel
+from models.store import StoreModel
+
+STORES = 100
+MODES = {'buffered': 'paginate=false', 'streamed': 'stream=true'}
+
+
+def seed(path, size):
+    """
+    Creates a database with size items spread over STORES stores.
+    :param path:
+    :param size:
+    """
+    engine = create_engine('sqlite:///' + path)
+    db.Model.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(StoreModel.__table__.insert(),
+                           [{'id': i, 'name': 'store-{}'.format(i)} for i in range(1, STORES + 1)])
+        connection.execute(ItemModel.__table__.insert(),
+                           [{'name': 'item-{}'.format(i), 'price': i / 100.0,
+                             'store_id': i % STORES + 1} for i in range(size)])
+    engine.dispose()
+
+
+def peak_rss_mb():
+    """
+    The peak resident set size of this process, in MB.
+    :return:
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def child(path, url):
+    """
+    Serves a single request for url and prints the peak RSS before and after.
+    :param path: the database file.
+    :param url:
+    """
+    client = create_bench_app(path).test_client()
+    client.get('/items?limit=1')
+    before = peak_rss_mb()
+    response = client.get(url, buffered=False)
+    size = 0
+    for chunk in response.response:
+        size += len(chunk)
+    response.close()
+    print(before, peak_rss_mb(), size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    print('{:>9} {:<8} {:<9} {:>10} {:>12}'.format('items', 'path', 'mode', 'body MB', 'RSS growth'))
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.db')
+            seed(path, size)
+            for path_name in ('/items', '/stores'):
+                for mode, query in MODES.items():
+                    output = subprocess.check_output(
+                        [sys.executable, '-m', 'benchmarks.streaming_memory', '--child', path,
+                         '{}?{}'.format(path_name, query)],
+                        stderr=subprocess.DEVNULL).decode().split()
+                    before, after, body = float(output[-3]), float(output[-2]), int(output[-1])
+                    print('{:>9} {:<8} {:<9} {:>10.1f} {:>10.1f}MB'.format(
+                        size, path_name, mode, body / 1e6, after - before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+CACHE
+Bounded, in-process LRU + TTL caches in front of the hot model lookups.
+Writes in this process invalidate the affected entries; other processes
+(uwsgi workers) see the change once the entry's TTL runs out.
+Every app has its own caches, in app.extensions['cache'], so apps in one process
+never share entries nor configure each other's caches.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_request_context
+from werkzeug.local import LocalProxy
+
+DEFAULT_MAXSIZE = 1024
+DEFAULT_TTL = 30.0
+DEFAULT_IDENTITY_TTL = 10.0
+
+
+def reads_primary():
+    """
+    Whether the current request must read from the primary database, see replicas.py.
+    Cached entries may have been loaded from a lagging replica, so such requests skip them.
+    :return:
+    """
+    return has_request_context() and g.get('db_read_primary', False)
+
+
+class LRUCache:
+    """
+    A thread-safe LRU cache whose entries also expire after ttl seconds.
+    Values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, name, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, see get_or_load().
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value for key, or calls loader() and caches its result.
+        Requests that read from the primary always call loader(), see reads_primary().
+        None results are not cached. A result loaded while an invalidation happened
+        is returned but not cached, since it may predate the write.
+        :param key:
+        :param loader: a callable returning the value for key.
+        :return:
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = None if reads_primary() else self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        value = loader()
+        if value is None or self.maxsize <= 0:
+            return value
+
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (now + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, key):
+        """
+        Drops the entry for key.
+        :param key:
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """
+        Drops every entry whose value matches predicate.
+        :param predicate: a callable taking a cached value.
+        """
+        with self._lock:
+            self._generation += 1
+            for key in [key for key, (_, value) in self._entries.items() if predicate(value)]:
+                del self._entries[key]
+
+    def clear(self):
+        """
+        Drops every entry.
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache counters.
+        :return:
+        """
+        with self._lock:
+            return {'size': len(self._entries),
+                    'maxsize': self.maxsize,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+def init_app(app):
+    """
+    Creates the caches of app, sized by CACHE_MAXSIZE (0 disables caching) and expiring
+    after CACHE_TTL seconds, IDENTITY_CACHE_TTL for the identities.
+    :param app:
+    """
+    maxsize = app.config.get('CACHE_MAXSIZE', DEFAULT_MAXSIZE)
+    ttl = app.config.get('CACHE_TTL', DEFAULT_TTL)
+    app.extensions['cache'] = {
+        'items': LRUCache('items', maxsize, ttl),
+        'stores': LRUCache('stores', maxsize, ttl),
+        'identities': LRUCache('identities', maxsize, app.config.get('IDENTITY_CACHE_TTL', DEFAULT_IDENTITY_TTL)),
+    }
+
+
+def app_caches(app=None):
+    """
+    Returns the caches of app, by name.
+    :param app: defaults to the current app.
+    :return:
+    """
+    return (app or current_app).extensions['cache']
+
+
+def all_stats(app=None):
+    """
+    Returns the counters of every cache of app, by name.
+    :param app: defaults to the current app.
+    :return:
+    """
+    return {name: cache.stats() for name, cache in app_caches(app).items()}
+
+
+# The caches of the current app.
+# item.json() by item name.
+item_cache = LocalProxy(lambda: app_caches()['items'])
+# store.json() by (store name, data versions), see StoreModel.find_json_by_name().
+store_cache = LocalProxy(lambda: app_caches()['stores'])
+# Detached UserModel instances by id, for the JWT identity handler. Every hit is a
+# query saved on a @jwt_required() request.
+identity_cache = LocalProxy(lambda: app_caches()['identities'])
@@ -0,0 +1,223 @@
+"""
+COMPRESSION
+gzip/brotli response compression negotiated from Accept-Encoding, for both
+buffered and streamed responses.
+"""
+import logging
+import threading
+import time
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional, only gzip is offered without it.
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_GZIP_LEVEL = 6
+DEFAULT_BROTLI_QUALITY = 4
+DEFAULT_MIMETYPES = ['application/json']
+
+
+class GzipCompressor:
+    """
+    Incremental gzip compression.
+    """
+
+    def __init__(self, config):
+        self._compressor = zlib.compressobj(config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        # A sync flush lets the client decode everything sent so far.
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    """
+    Incremental brotli compression.
+    """
+
+    def __init__(self, config):
+        self._compressor = brotli.Compressor(quality=config['COMPRESS_BROTLI_QUALITY'])
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+# The supported content codings, in order of preference.
+COMPRESSORS = {'gzip': GzipCompressor}
+if brotli is not None:
+    COMPRESSORS = {'br': BrotliCompressor, 'gzip': GzipCompressor}
+
+
+class CompressionStats:
+    """
+    Totals of the compressed responses, by content coding.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, encoding, size_in, size_out, cpu_seconds):
+        """
+        Records one compressed response.
+        :param encoding: 'gzip' or 'br'.
+        :param size_in: the uncompressed size in bytes.
+        :param size_out: the compressed size in bytes.
+        :param cpu_seconds: the CPU time spent compressing.
+        """
+        with self._lock:
+            totals = self._totals.setdefault(
+                encoding, {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_seconds': 0.0})
+            totals['responses'] += 1
+            totals['bytes_in'] += size_in
+            totals['bytes_out'] += size_out
+            totals['cpu_seconds'] += cpu_seconds
+        logger.debug("%s %s: %d -> %d bytes (ratio %.2f) in %.2fms CPU", encoding, request_path(),
+                     size_in, size_out, size_in / float(size_out or 1), cpu_seconds * 1000)
+
+    def json(self):
+        """
+        Returns the totals in dict format, with the overall ratio of each coding.
+        :return:
+        """
+        with self._lock:
+            return {encoding: dict(totals, ratio=totals['bytes_in'] / float(totals['bytes_out'] or 1))
+                    for encoding, totals in self._totals.items()}
+
+
+compression_stats = CompressionStats()
+
+
+def strip_encoding_suffix(etag):
+    """
+    Returns an ETag without the content coding suffix compress_response() appended to it.
+    :param etag:
+    :return:
+    """
+    for encoding in COMPRESSORS:
+        suffix = '-' + encoding
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)]
+    return etag
+
+
+def request_path():
+    """
+    The path of the current request, if any, for the log line.
+    :return:
+    """
+    try:
+        return request.path
+    except RuntimeError:
+        return '-'
+
+
+def compressible(response, config):
+    """
+    Whether response is of a kind that gets compressed.
+    :param response:
+    :param config:
+    :return:
+    """
+    return not (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in config['COMPRESS_MIMETYPES'])
+
+
+def compress_stream(chunks, encoding, compressor):
+    """
+    Compresses a streamed body chunk by chunk, and records the totals once it ends.
+    :param chunks: the original iterable of the response.
+    :param encoding:
+    :param compressor:
+    :return:
+    """
+    size_in = size_out = 0
+    cpu_seconds = 0.0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            start = time.thread_time()
+            data = compressor.compress(chunk) + compressor.flush()
+            cpu_seconds += time.thread_time() - start
+            size_in += len(chunk)
+            size_out += len(data)
+            if data:
+                yield data
+        start = time.thread_time()
+        data = compressor.finish()
+        cpu_seconds += time.thread_time() - start
+        size_out += len(data)
+        yield data
+        compression_stats.record(encoding, size_in, size_out, cpu_seconds)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def init_app(app):
+    """
+    Compresses every eligible response of app. Configured by COMPRESS_MIN_SIZE (bytes,
+    buffered responses only), COMPRESS_GZIP_LEVEL, COMPRESS_BROTLI_QUALITY and
+    COMPRESS_MIMETYPES.
+    :param app:
+    """
+    app.config.setdefault('COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE)
+    app.config.setdefault('COMPRESS_GZIP_LEVEL', DEFAULT_GZIP_LEVEL)
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', DEFAULT_BROTLI_QUALITY)
+    app.config.setdefault('COMPRESS_MIMETYPES', DEFAULT_MIMETYPES)
+
+    @app.after_request
+    def compress_response(response):
+        """
+        Compresses the response with the best coding the client accepts.
+        """
+        config = app.config
+        if not compressible(response, config):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(list(COMPRESSORS))
+        if encoding is None:
+            return response
+        compressor = COMPRESSORS[encoding](config)
+
+        if response.is_streamed:
+            # The size is unknown up front, so streamed bodies are always compressed.
+            response.response = compress_stream(response.response, encoding, compressor)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < config['COMPRESS_MIN_SIZE']:
+                return response
+            start = time.thread_time()
+            compressed = compressor.compress(data) + compressor.finish()
+            compression_stats.record(encoding, len(data), len(compressed), time.thread_time() - start)
+            response.set_data(compressed)
+
+        response.headers['Content-Encoding'] = encoding
+        # The compressed bytes are a different representation, so they need their own strong ETag.
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag('{}-{}'.format(etag, encoding), weak)
+        return response
@@ -0,0 +1,91 @@
+"""
+CONDITIONAL
+ETags derived from the data versions, and 304 Not Modified responses for
+GET requests whose If-None-Match still matches.
+"""
+import functools
+import hashlib
+
+from flask import Response, g, request
+from flask_restful.utils import unpack
+
+from compression import strip_encoding_suffix
+from models.version import DataVersionModel
+
+
+def compute_etag(names):
+    """
+    Returns the ETag of the current request's response given the data versions it
+    depends on. The path and query string are part of it, so every page, filter and
+    format of a list gets its own tag.
+    :param names: the names of the data versions.
+    :return:
+    """
+    versions = tuple(sorted(DataVersionModel.find_versions(names).items()))
+    # Handlers can key caches on the versions, see current_versions().
+    g.data_versions = versions
+    key = '{} {} {}'.format(versions, request.path, request.query_string.decode('latin-1'))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def current_versions():
+    """
+    Returns the data versions the ETag of the current request was computed from, as a
+    hashable tuple, or None outside of a conditional request. A cache keyed on them can
+    never pair a new ETag with a body another worker has since changed.
+    :return:
+    """
+    return g.get('data_versions')
+
+
+def matching_tag(etag):
+    """
+    Returns the tag of If-None-Match that matches etag, if any. It is the ETag the
+    client got with its copy, e.g. with the content coding suffix of a compressed one.
+    :param etag:
+    :return: a (tag, weak) tuple, or None if the client doesn't have the representation.
+    """
+    if_none_match = request.if_none_match
+    if if_none_match.star_tag:
+        return etag, False
+    for tag in if_none_match.as_set(include_weak=True):
+        if strip_encoding_suffix(tag) == etag:
+            return tag, if_none_match.is_weak(tag)
+    return None
+
+
+def conditional(version_names):
+    """
+    Decorates a GET method with ETag/If-None-Match handling. A matching request gets a
+    304 after a single query on the data versions, before the method runs.
+    :param version_names: a callable taking the method's arguments and returning the
+        names of the data versions the response depends on, or None to skip the check
+        (e.g. when the resource doesn't exist).
+    :return:
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            names = version_names(*args, **kwargs)
+            if names is None:
+                return func(*args, **kwargs)
+            etag = compute_etag(names)
+            matched = matching_tag(etag)
+            if matched is not None:
+                # The validator the client already has, and no body, so no Content-Type.
+                response = Response(status=304)
+                response.set_etag(*matched)
+                del response.headers['Content-Type']
+                return response
+
+            result = func(*args, **kwargs)
+            if isinstance(result, Response):
+                if result.status_code == 200:
+                    result.set_etag(etag)
+                return result
+            data, code, headers = unpack(result)
+            if code == 200:
+                headers = dict(headers or {}, ETag='"{}"'.format(etag))
+            return data, code, headers
+        return wrapper
+    return decorator
@@ -0,0 +1,7 @@
+"""
+CONFIG
+The settings run:app and asgi:app share, importable without building an app.
+"""
+
+# Signs the sessions and the JWTs of both apps.
+SECRET_KEY = 'jose'
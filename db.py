@@ -2,14 +2,350 @@
 DB
 The file that stores database related stuff.
 """
+import functools
+import logging
+import random
+import sqlite3
+import threading
+import time
+import weakref
 
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy, SignallingSession
+from sqlalchemy import event, inspect, orm
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.base import Executable
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.expression import ClauseElement
+
+from search import create_search_index
+
+
+logger = logging.getLogger(__name__)
+
+# The pragmas applied to every new SQLite connection, by config key. Set a key to None
+# in the app config to leave that pragma at SQLite's default.
+SQLITE_PRAGMAS = {
+    # Readers don't block the writer, and the writer doesn't block readers.
+    'SQLITE_JOURNAL_MODE': ('journal_mode', 'WAL'),
+    # Safe with WAL: a power loss may lose the last commits, but never corrupts the file.
+    'SQLITE_SYNCHRONOUS': ('synchronous', 'NORMAL'),
+    # Wait this many milliseconds for a lock instead of failing with "database is locked".
+    'SQLITE_BUSY_TIMEOUT': ('busy_timeout', 5000),
+    # Read the database through a memory map of up to this many bytes.
+    'SQLITE_MMAP_SIZE': ('mmap_size', 256 * 1024 * 1024),
+    # Page cache per connection, negative values are in KiB.
+    'SQLITE_CACHE_SIZE': ('cache_size', -64 * 1024),
+    'SQLITE_FOREIGN_KEYS': ('foreign_keys', 'ON'),
+}
+
+
+# The pool settings of server databases (PostgreSQL), by config key.
+POOL_OPTIONS = {
+    'DB_POOL_SIZE': ('pool_size', 5),
+    'DB_MAX_OVERFLOW': ('max_overflow', 10),
+    # Seconds after which a connection is replaced, before the server or a proxy drops it.
+    'DB_POOL_RECYCLE': ('pool_recycle', 1800),
+    # Test connections on checkout so a restarted database doesn't fail requests.
+    'DB_POOL_PRE_PING': ('pool_pre_ping', True),
+    # Seconds to wait for a free connection before giving up.
+    'DB_POOL_TIMEOUT': ('pool_timeout', 30),
+}
+
+
+class PoolStats:
+    """
+    Counts connection checkouts and the time spent waiting for them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, seconds, timed_out=False):
+        """
+        Records one checkout.
+        :param seconds: the time the checkout took.
+        :param timed_out: whether it gave up after DB_POOL_TIMEOUT.
+        """
+        with self._lock:
+            self.checkouts += 1
+            if timed_out:
+                self.timeouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def json(self):
+        """
+        Returns the counters in dict format.
+        :return:
+        """
+        with self._lock:
+            return {'checkouts': self.checkouts,
+                    'timeouts': self.timeouts,
+                    'wait_seconds_total': self.wait_seconds_total,
+                    'wait_seconds_max': self.wait_seconds_max}
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    """
+    A QueuePool that records how long every checkout waits in pool_stats.
+    """
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            pool_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_stats.record(time.perf_counter() - start)
+        return connection
+
+
+def apply_sqlite_pragmas(pragmas, dbapi_connection, connection_record):
+    """
+    A connect event listener that runs the given pragmas on a new SQLite connection.
+    :param pragmas: a list of (pragma, value) tuples.
+    :param dbapi_connection:
+    :param connection_record:
+    """
+    cursor = dbapi_connection.cursor()
+    for pragma, value in pragmas:
+        cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+    cursor.close()
+
+
+# The SQLALCHEMY_BINDS keys of the read replicas are this prefix and a number.
+REPLICA_BIND_PREFIX = 'replica_'
+
+
+def replica_binds(app):
+    """
+    The bind keys of app's read replicas, see DATABASE_REPLICA_URLS.
+    :param app:
+    :return:
+    """
+    return sorted(key for key in app.config.get('SQLALCHEMY_BINDS') or ()
+                  if key.startswith(REPLICA_BIND_PREFIX))
+
+
+class RoutingSession(SignallingSession):
+    """
+    A session that reads from a replica once use_replica() was called, until it writes.
+    Flushes and INSERT/UPDATE/DELETE statements (ReturningInsert included) always go to the
+    primary, and from the first of them on, so do the reads: the session sees its own writes.
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def use_replica(self):
+        """
+        Sends the reads of this session to one of the replicas, picked at random, if any.
+        :return: the bind key of the replica, or None.
+        """
+        binds = replica_binds(self.app)
+        self.info['replica'] = random.choice(binds) if binds else None
+        return self.info['replica']
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        # kwargs: what scoped_session.get_bind() passes along, SignallingSession ignores it too.
+        replica = self.info.get('replica')
+        if replica is not None:
+            if not self._flushing and not isinstance(clause, (UpdateBase, ReturningInsert)):
+                return self.db.get_engine(self.app, bind=replica)
+            # Stick to the primary for the rest of the session.
+            self.info['replica'] = None
+            self.info['wrote'] = True
+        return super().get_bind(mapper, clause)
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """
+    Flask-SQLAlchemy with a production profile for SQLite engines, see SQLITE_PRAGMAS,
+    a configurable, timed connection pool for other databases, see POOL_OPTIONS, and
+    sessions that can read from replicas, see RoutingSession.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tuned_engines = weakref.WeakSet()
+        self._tuning_lock = threading.Lock()
+
+    def init_app(self, app):
+        for key, (_, value) in list(SQLITE_PRAGMAS.items()) + list(POOL_OPTIONS.items()):
+            app.config.setdefault(key, value)
+        super().init_app(app)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        if sa_url.drivername == 'postgres':
+            # Heroku still hands out postgres:// URLs, which SQLAlchemy 1.4 no longer accepts.
+            sa_url = sa_url.set(drivername='postgresql')
+        if not sa_url.drivername.startswith('sqlite'):
+            options.setdefault('poolclass', TimedQueuePool)
+            for key, (option, _) in POOL_OPTIONS.items():
+                options.setdefault(option, app.config[key])
+        return sa_url, options
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def get_engine(self, app=None, bind=None):
+        engine = super().get_engine(app, bind)
+        if engine.dialect.name == 'sqlite' and engine not in self._tuned_engines:
+            config = self.get_app(app).config
+            pragmas = [(pragma, config[key]) for key, (pragma, _) in SQLITE_PRAGMAS.items()
+                       if config.get(key) is not None]
+            with self._tuning_lock:
+                if engine not in self._tuned_engines:
+                    event.listen(engine, 'connect', functools.partial(apply_sqlite_pragmas, pragmas))
+                    self._tuned_engines.add(engine)
+        return engine
 
 
 # A SQL Alchemy DB object
 db = SQLAlchemy()
 
 
+def dispose_engines(app):
+    """
+    Drops the pooled connections inherited from the parent process, on the primary and
+    on the replicas. Call it in every forked worker (uwsgi postfork), so that processes
+    never share a connection. close=False leaves the sockets alone for the parent that
+    still owns them.
+    :param app:
+    """
+    for bind in [None] + replica_binds(app):
+        db.get_engine(app, bind).dispose(close=False)
+
+
+def engine_stats(app):
+    """
+    Returns the state of the connection pool and the checkout counters.
+    :param app:
+    :return:
+    """
+    pool = db.get_engine(app).pool
+    stats = {'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({'size': pool.size(),
+                      'checked_out': pool.checkedout(),
+                      'overflow': pool.overflow(),
+                      'checked_in': pool.checkedin()})
+    stats.update(pool_stats.json())
+    return stats
+
+
+# The INSERT constructs that support ON CONFLICT, by dialect name.
+UPSERT_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def upsert_insert(table, dialect_name=None):
+    """
+    Returns an INSERT for table that supports on_conflict_do_update/on_conflict_do_nothing.
+    :param table:
+    :param dialect_name: defaults to the dialect of db.engine.
+    :return:
+    """
+    dialect_name = dialect_name or db.engine.dialect.name
+    try:
+        return UPSERT_INSERTS[dialect_name](table)
+    except KeyError:
+        raise NotImplementedError("Upserts are not supported on {}.".format(dialect_name))
+
+
+class ReturningInsert(Executable, ClauseElement):
+    """
+    An INSERT ... RETURNING for SQLite, which has supported RETURNING since 3.35 while
+    SQLAlchemy 1.4 only compiles it for PostgreSQL. Not an UpdateBase, so RoutingSession
+    checks for it by name to keep it on the primary.
+    """
+    inherit_cache = False
+
+    def __init__(self, insert, columns):
+        self.insert = insert
+        self.columns = list(columns)
+
+
+@compiles(ReturningInsert)
+def compile_returning_insert(element, compiler, **kw):
+    """
+    Renders a ReturningInsert. The statement is executed like a SELECT: its rows are the
+    result, and SQLAlchemy doesn't look for the inserted primary key.
+    """
+    insert = compiler.process(element.insert, **kw)
+    compiler.isinsert = False
+    return '{} RETURNING {}'.format(insert, ', '.join(compiler.preparer.format_column(column)
+                                                       for column in element.columns))
+
+
+def upsert_returning(statement, columns, dialect=None):
+    """
+    Adds a RETURNING clause to an upsert_insert() statement, so that executing it returns
+    the inserted or updated row, and nothing when ON CONFLICT DO NOTHING skipped it.
+    :param statement:
+    :param columns: the columns to return.
+    :param dialect: defaults to the dialect of db.engine.
+    :return: the statement, or None when the database can't return rows from an INSERT.
+    """
+    dialect = dialect or db.engine.dialect
+    if dialect.full_returning:
+        return statement.returning(*columns)
+    if dialect.name == 'sqlite' and sqlite3.sqlite_version_info >= (3, 35):
+        return ReturningInsert(statement, columns)
+    return None
+
 
+def create_missing_indexes(engine=None):
+    """
+    Creates the indexes declared on the models that are missing from the database.
+    db.create_all() only creates indexes together with new tables, so databases created
+    before an index was declared never get it.
+    :param engine: the engine to migrate, defaults to db.engine.
+    :return: the names of the indexes that were created.
+    """
+    engine = engine or db.engine
+    inspector = inspect(engine)
+    created = []
+    for table in db.Model.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(bind=engine)
+            except IntegrityError as e:
+                # A unique index cannot be built while duplicate rows exist.
+                logger.warning("Could not create index %s: %s", index.name, e.orig)
+                continue
+            created.append(index.name)
+    return created
 
 
+def init_db(app):
+    """
+    Creates the missing tables and indexes of app's database, and its search index.
+    It runs once per start, in the uwsgi master before it forks the workers (see run.py)
+    or with `flask init-db`, so no request ever pays for the schema check.
+    :param app:
+    :return: the names of the indexes that were created.
+    """
+    with app.app_context():
+        # The primary only: replicas get the schema through replication.
+        db.create_all(bind=None)
+        created = create_missing_indexes()
+        search_index = create_search_index(db.engine)
+        return created + [search_index] if search_index else created
@@ -0,0 +1,66 @@
+"""
+FIELDSETS
+Sparse fieldsets: ?fields= picks the columns a response carries, ?embed= whether
+stores embed their items. The models only load the columns that were picked.
+"""
+
+# The values of ?embed=.
+EMBEDS = ('items', 'none')
+
+
+def fieldset(names):
+    """
+    Returns a reqparse type for the fields argument: a comma-separated subset of names.
+    :param names: the fields that can be picked, in the order of the response.
+    :return:
+    """
+    def parse(value):
+        requested = {field.strip() for field in str(value).split(',') if field.strip()}
+        unknown = requested.difference(names)
+        if unknown or not requested:
+            raise ValueError("fields must be a comma-separated list of {}.".format(', '.join(names)))
+        return tuple(name for name in names if name in requested)
+    return parse
+
+
+def add_fields_arguments(parser, names, embed=False):
+    """
+    Adds the query string arguments of sparse fieldsets to a reqparse.RequestParser.
+    :param parser:
+    :param names: the fields that can be picked, see fieldset().
+    :param embed: whether the resource takes ?embed= too.
+    :return: parser.
+    """
+    parser.add_argument('fields', type=fieldset(names), location='args')
+    if embed:
+        parser.add_argument('embed', choices=EMBEDS, location='args', default='items')
+    return parser
+
+
+def split_fields(fields, prefix):
+    """
+    Splits ?fields= into the fields of the resource and those of the embedded prefix
+    objects, e.g. ('name', 'items.price') into (('name',), ('price',)) for 'items'.
+    Either part is None when it picks nothing: all the fields then apply.
+    :param fields: the parsed fields argument, or None.
+    :param prefix:
+    :return: a (fields, nested fields) tuple.
+    """
+    if fields is None:
+        return None, None
+    start = prefix + '.'
+    own = tuple(field for field in fields if not field.startswith(start))
+    nested = tuple(field[len(start):] for field in fields if field.startswith(start))
+    return own or None, nested or None
+
+
+def select_fields(json, fields):
+    """
+    Returns the given fields of a row in JSON (dict) format, e.g. a cached one.
+    :param json:
+    :param fields: the fields to keep, None keeps them all.
+    :return:
+    """
+    if fields is None:
+        return json
+    return {field: json[field] for field in fields}
@@ -0,0 +1,165 @@
+"""
+METRICS
+Prometheus metrics of the API at /metrics: request latency histograms per
+resource and method, in-flight requests, and the connection pool and cache
+counters. Under uwsgi, set PROMETHEUS_MULTIPROC_DIR so that every worker writes
+its samples to a shared directory and any worker can report the totals.
+"""
+import os
+import threading
+import time
+
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest)
+from prometheus_client.multiprocess import MultiProcessCollector, mark_process_dead
+
+import cache
+from db import engine_stats
+
+# How often a worker copies its pool and cache counters into the metrics, in seconds.
+SYNC_INTERVAL = 1.0
+
+REQUEST_LATENCY = Histogram('api_request_duration_seconds', 'Request latency, until the body is sent.',
+                            ['resource', 'method'])
+REQUESTS = Counter('api_requests_total', 'Requests by response status.', ['resource', 'method', 'status'])
+IN_PROGRESS = Gauge('api_requests_in_progress', 'Requests being handled.', ['resource', 'method'],
+                    multiprocess_mode='livesum')
+
+POOL_SIZE = Gauge('db_pool_size', 'Connections kept in the pools.', multiprocess_mode='livesum')
+POOL_CHECKED_OUT = Gauge('db_pool_checked_out', 'Connections in use.', multiprocess_mode='livesum')
+POOL_OVERFLOW = Gauge('db_pool_overflow', 'Connections opened beyond the pool size.',
+                      multiprocess_mode='livesum')
+POOL_WAIT_MAX = Gauge('db_pool_wait_seconds_max', 'Longest wait for a connection.', multiprocess_mode='livemax')
+POOL_COUNTERS = {'checkouts': Counter('db_pool_checkouts_total', 'Connection checkouts.'),
+                 'timeouts': Counter('db_pool_timeouts_total', 'Checkouts that timed out.'),
+                 'wait_seconds_total': Counter('db_pool_wait_seconds_total', 'Time spent waiting for a connection.')}
+
+CACHE_ENTRIES = Gauge('cache_entries', 'Entries in the cache.', ['cache'], multiprocess_mode='livesum')
+CACHE_COUNTERS = {'hits': Counter('cache_hits_total', 'Cache hits.', ['cache']),
+                  'misses': Counter('cache_misses_total', 'Cache misses.', ['cache']),
+                  'evictions': Counter('cache_evictions_total', 'Cache evictions.', ['cache'])}
+
+
+class StatsSync:
+    """
+    Copies the counters of db.pool_stats and of the caches, which live in each worker,
+    into the metrics. Counters are advanced by what changed since the last copy.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_sync = 0.0
+        self._last_values = {}
+
+    def _advance(self, counter, key, value):
+        delta = value - self._last_values.get(key, 0)
+        if delta > 0:
+            counter.inc(delta)
+        self._last_values[key] = value
+
+    def sync(self, app, force=False):
+        """
+        Copies the counters, at most every SYNC_INTERVAL seconds unless force is set.
+        :param app:
+        :param force:
+        """
+        now = time.monotonic()
+        if not force and now - self._last_sync < SYNC_INTERVAL:
+            return
+        with self._lock:
+            self._last_sync = now
+            pool = engine_stats(app)
+            POOL_SIZE.set(pool.get('size', 0))
+            POOL_CHECKED_OUT.set(pool.get('checked_out', 0))
+            POOL_OVERFLOW.set(max(pool.get('overflow', 0), 0))
+            POOL_WAIT_MAX.set(pool['wait_seconds_max'])
+            for name, counter in POOL_COUNTERS.items():
+                self._advance(counter, ('pool', name), pool[name])
+            for name, stats in cache.all_stats(app).items():
+                CACHE_ENTRIES.labels(name).set(stats['size'])
+                for key, counter in CACHE_COUNTERS.items():
+                    self._advance(counter.labels(name), (name, key), stats[key])
+
+
+stats_sync = StatsSync()
+
+
+def multiprocess():
+    """
+    Whether the workers write their samples to PROMETHEUS_MULTIPROC_DIR.
+    :return:
+    """
+    return 'PROMETHEUS_MULTIPROC_DIR' in os.environ or 'prometheus_multiproc_dir' in os.environ
+
+
+def mark_worker_dead():
+    """
+    Drops the gauge samples of this worker, so that the 'livesum' and 'livemax' gauges
+    stop counting it once it exits. Runs at the exit of every worker, see run.py.
+    """
+    if multiprocess():
+        mark_process_dead(os.getpid())
+
+
+def registry():
+    """
+    The registry to report: the merged files of every worker in multiprocess mode, or
+    the samples of this process.
+    :return:
+    """
+    if multiprocess():
+        merged = CollectorRegistry()
+        MultiProcessCollector(merged)
+        return merged
+    return REGISTRY
+
+
+def resource_label(app):
+    """
+    The name of the Resource class handling the current request, e.g. 'ItemList'.
+    :param app:
+    :return:
+    """
+    view = app.view_functions.get(request.endpoint)
+    if view is None:
+        return 'unmatched'
+    return getattr(getattr(view, 'view_class', None), '__name__', request.endpoint)
+
+
+def init_app(app):
+    """
+    Instruments every request of app and adds the /metrics endpoint.
+    :param app:
+    """
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_labels = (resource_label(app), request.method)
+        g.metrics_start = time.perf_counter()
+        IN_PROGRESS.labels(*g.metrics_labels).inc()
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exception=None):
+        """
+        Runs once the body is sent, also for streamed responses and unhandled errors.
+        """
+        labels = g.pop('metrics_labels', None)
+        if labels is None:
+            return
+        IN_PROGRESS.labels(*labels).dec()
+        REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - g.metrics_start)
+        REQUESTS.labels(labels[0], labels[1], str(g.get('metrics_status', 500))).inc()
+        stats_sync.sync(app)
+
+    @app.route('/metrics')
+    def metrics():
+        """
+        The metrics in the Prometheus text format.
+        """
+        stats_sync.sync(app, force=True)
+        return Response(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)
@@ -2,7 +2,13 @@
 MODELS/ITEM
 """
 
-from db import db
+from sqlalchemy import case, func, inspect, literal_column, tuple_
+
+from cache import item_cache, store_cache
+from db import db, upsert_insert, upsert_returning
+from models.version import DataVersionModel
+from pagination import decode_cursor, encode_cursor, paginate
+from search import contains, like_pattern, search_strategy
 
 
 class ItemModel(db.Model):
@@ -10,13 +16,20 @@ class ItemModel(db.Model):
     ItemModel class is the internal representation of Item objects.
     """
     __tablename__ = "items"
+    # Serves ?store_id= with a price range or ?sort=price, see filters().
+    __table_args__ = (db.Index('ix_items_store_id_price', 'store_id', 'price'),)
+
+    # The orders of /items?sort=, a leading '-' sorts from the largest value down.
+    SORTS = ('id', '-id', 'price', '-price')
+    # The fields of json(), in order, that ?fields= picks from.
+    FIELDS = ('id', 'name', 'price', 'store_id')
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(80))
-    price = db.Column(db.Float(precision=2))
+    name = db.Column(db.String(80), unique=True, index=True)
+    price = db.Column(db.Float(precision=2), index=True)
 
-    store_id = db.Column(db.Integer, db.ForeignKey('stores.id'))
-    store = db.relationship('StoreModel')
+    store_id = db.Column(db.Integer, db.ForeignKey('stores.id'), index=True)
+    store = db.relationship('StoreModel', back_populates='items')
 
     def __init__(self, name, price, store_id):
         self.name = name
@@ -43,24 +56,317 @@ class ItemModel(db.Model):
         return cls.query.filter_by(name=name).first()
 
     @classmethod
-    def find_all(cls):
+    def find_json_by_name(cls, name):
+        """
+        Returns the JSON of the item called name, or None, read through item_cache.
+        :param name:
+        :return:
+        """
+        def load():
+            item = cls.find_by_name(name)
+            return item.json() if item else None
+        return item_cache.get_or_load(name, load)
+
+    @classmethod
+    def filters(cls, min_price=None, max_price=None, store_id=None):
+        """
+        Returns the conditions matching the items in the price range and store, None
+        arguments don't filter. The indexes on (store_id, price) and price serve every
+        combination. Works on ORM queries and on select() statements alike.
+        :param min_price: inclusive.
+        :param max_price: inclusive.
+        :param store_id:
+        :return: a list of conditions.
+        """
+        conditions = []
+        if store_id is not None:
+            conditions.append(cls.store_id == store_id)
+        if min_price is not None:
+            conditions.append(cls.price >= min_price)
+        if max_price is not None:
+            conditions.append(cls.price <= max_price)
+        return conditions
+
+    @classmethod
+    def sort_key(cls, sort):
+        """
+        The columns an order of SORTS pages on, and whether it is descending.
+        Prices aren't unique, so the id breaks ties.
+        :param sort: one of SORTS.
+        :return: a (columns, descending) tuple.
+        """
+        columns = [cls.price, cls.id] if sort.lstrip('-') == 'price' else [cls.id]
+        return columns, sort.startswith('-')
+
+    @classmethod
+    def load_fields(cls, fields, *required):
+        """
+        Returns the query of the items or, with fields, of rows of only those columns:
+        the other columns aren't read, and no model is built for the rows, which costs
+        more than reading them. Serialize the results with row_json().
+        :param fields: the FIELDS to select, None selects the models.
+        :param required: more columns the caller reads, e.g. the key of a page.
+        :return:
+        """
+        if fields is None:
+            return cls.query
+        columns = [getattr(cls, field) for field in fields]
+        return db.session.query(*columns + [column for column in required if column.key not in fields])
+
+    @staticmethod
+    def row_json(row, fields=None):
+        """
+        Returns an item, or a row of load_fields(), in dict format.
+        :param row:
+        :param fields: the fields load_fields() selected, None for an item.
+        :return:
+        """
+        if fields is None:
+            return row.json()
+        return {field: getattr(row, field) for field in fields}
+
+    @classmethod
+    def sorted_query(cls, sort, fields=None, **filters):
+        """
+        Returns the query of the items matching filters in the order sort.
+        :param sort: one of SORTS.
+        :param fields: the FIELDS to select, see load_fields().
+        :param filters: see filters().
+        :return:
         """
+        columns, descending = cls.sort_key(sort)
+        return cls.load_fields(fields).filter(*cls.filters(**filters)).order_by(
+            *[column.desc() if descending else column for column in columns])
 
+    @classmethod
+    def find_all(cls, sort='id', fields=None, **filters):
+        """
+        Returns every item matching filters, see filters(), in the order sort.
+        :param sort: one of SORTS.
+        :param fields: the FIELDS to select, see load_fields().
+        :param filters:
         :return:
         """
-        return cls.query.all()
+        return cls.sorted_query(sort, fields, **filters).all()
+
+    @classmethod
+    def iter_all(cls, chunk_size, sort='id', fields=None, **filters):
+        """
+        Iterates over every item matching filters, fetching chunk_size rows at a time from
+        the database (server-side cursor on PostgreSQL) instead of loading the whole table.
+        :param chunk_size:
+        :param sort: one of SORTS.
+        :param fields: the FIELDS to select, see load_fields().
+        :param filters: see filters().
+        :return:
+        """
+        return cls.sorted_query(sort, fields, **filters).yield_per(chunk_size)
+
+    @classmethod
+    def find_page(cls, limit, cursor=None, sort='id', fields=None, **filters):
+        """
+        Returns a (items, next_cursor) page of the items matching filters in the order sort.
+        The cursor holds the key of sort_key() of the last item, e.g. its (price, id).
+        :param limit: the page size.
+        :param cursor: the cursor of the previous page.
+        :param sort: one of SORTS.
+        :param fields: the FIELDS to select, see load_fields().
+        :param filters: see filters().
+        :return:
+        """
+        columns, descending = cls.sort_key(sort)
+        return paginate(cls.load_fields(fields, *columns).filter(*cls.filters(**filters)),
+                        columns, limit, cursor, descending)
+
+    @classmethod
+    def search(cls, term, limit, cursor=None):
+        """
+        Returns a (items, next_cursor) page of the items whose name contains term, ignoring
+        case, through the search index when the database has one (see search.py).
+        Names starting with term come first, then shorter names, then older items; the
+        cursor holds that sort key of the last item of the page. The ranking is a heuristic
+        that works the same with and without a search index, not bm25() or similarity().
+        The index finds the matches, which are all sorted for every page.
+        :param term:
+        :param limit: the page size.
+        :param cursor: the cursor of the previous page.
+        :return:
+        """
+        rank = case((cls.name.ilike(like_pattern(term, prefix_only=True), escape='\\'), 0), else_=1)
+        length = func.length(cls.name)
+        strategy = search_strategy(db.session.get_bind(cls.__mapper__))
+        query = db.session.query(cls, rank, length).filter(contains(cls.id, cls.name, term, strategy))
+        if cursor is not None:
+            last = decode_cursor(cursor)
+            if not (isinstance(last, list) and len(last) == 3 and all(isinstance(key, int) for key in last)):
+                raise ValueError("Invalid cursor.")
+            query = query.filter(tuple_(rank, length, cls.id) > tuple_(*last))
+        rows = query.order_by(rank, length, cls.id).limit(limit + 1).all()
+        if len(rows) <= limit:
+            return [item for item, _, _ in rows], None
+        item, item_rank, item_length = rows[limit - 1]
+        return [item for item, _, _ in rows[:limit]], encode_cursor([item_rank, item_length, item.id])
 
     def save_to_db(self):
         """
         An internal model function that inserts data into database.
         """
         # Add the new item to current list of items (or the database if it exists)
+        name = self.name
+        # The store the item is in, and the one it is moving out of, if any.
+        store_ids = {self.store_id}.union(inspect(self).attrs.store_id.history.deleted)
         db.session.add(self)
+        self.bump_versions(store_ids)
         db.session.commit()
+        self.invalidate_cache([name], store_ids)
 
     def delete_from_db(self):
         """
         An internal Item model method to update the database upon user's PUT request.
         """
+        name, store_id = self.name, self.store_id
         db.session.delete(self)
+        self.bump_versions([store_id])
         db.session.commit()
+        self.invalidate_cache([name], [store_id])
+
+    @classmethod
+    def upsert(cls, name, price, store_id, overwrite=True):
+        """
+        Creates the item, or sets the price of the existing item with that name when
+        overwrite is True, with a single INSERT ... ON CONFLICT (name) statement. Unlike
+        a find_by_name() followed by a write, concurrent calls can't create duplicates.
+        The row comes back through RETURNING (PostgreSQL, SQLite 3.35+); older SQLite
+        versions read an overwritten row back in the same transaction.
+        :param name:
+        :param price:
+        :param store_id:
+        :param overwrite: update an existing item (PUT) or leave it untouched (POST).
+        :return: the item in JSON format, or None if it already existed and overwrite is False.
+        """
+        table = cls.__table__
+        statement = cls.upsert_statement(name, price, store_id, overwrite)
+        returning = upsert_returning(statement, table.c)
+        if returning is not None:
+            row = db.session.execute(returning).first()
+            item = dict(row._mapping) if row else None
+            if item is not None and item['price'] is not None:
+                # SQLite returns the value it was given, e.g. 6 for 6.0, before the column's affinity.
+                item['price'] = float(item['price'])
+        else:
+            result = db.session.execute(statement)
+            if result.rowcount == 0:
+                item = None
+            elif not overwrite:
+                item = {'id': result.inserted_primary_key[0],
+                        'name': name,
+                        'price': price,
+                        'store_id': store_id}
+            else:
+                item = dict(db.session.execute(table.select().where(table.c.name == name)).first()._mapping)
+        if item is not None:
+            cls.bump_versions({store_id, item['store_id']})
+        db.session.commit()
+
+        if item is not None:
+            cls.invalidate_cache([name], {store_id, item['store_id']})
+        return item
+
+    @classmethod
+    def upsert_statement(cls, name, price, store_id, overwrite=True, dialect_name=None):
+        """
+        Returns the INSERT ... ON CONFLICT (name) statement of upsert().
+        :param name:
+        :param price:
+        :param store_id:
+        :param overwrite:
+        :param dialect_name: defaults to the dialect of db.engine.
+        :return:
+        """
+        table = cls.__table__
+        statement = upsert_insert(table, dialect_name).values(name=name, price=price, store_id=store_id)
+        if overwrite:
+            return statement.on_conflict_do_update(
+                index_elements=[table.c.name], set_={'price': statement.excluded.price})
+        return statement.on_conflict_do_nothing(index_elements=[table.c.name])
+
+    @classmethod
+    def upsert_many(cls, rows, chunk_size, atomic=True):
+        """
+        Inserts or updates many items with one multi-row
+        INSERT ... VALUES (...), (...) ON CONFLICT (name) DO UPDATE per chunk of chunk_size rows.
+        Like upsert(), an existing item only gets the new price and stays in its store.
+        On PostgreSQL the statement returns whether it created each row (xmax is 0 for
+        an inserted row). Elsewhere the status comes from the rows found right before
+        the statement, so it is best-effort: an item created by a concurrent request in
+        between is reported as created.
+        :param rows: a list of {'name', 'price', 'store_id'} dicts with distinct names.
+        :param chunk_size: the number of rows per statement.
+        :param atomic: commit once at the end (True) or after every chunk (False).
+        :return: a dict mapping every name to 'created' or 'updated'.
+        """
+        table = cls.__table__
+        statuses = {}
+        pending_names, pending_store_ids = [], set()
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            statement = upsert_insert(table).values(chunk)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.name], set_={'price': statement.excluded.price})
+            if db.engine.dialect.name == 'postgresql':
+                created = literal_column('xmax = 0').label('created')
+                # The store of every row, which for an updated item is the one it was in.
+                results = db.session.execute(statement.returning(table.c.name, table.c.store_id, created))
+            else:
+                existing = dict(db.session.query(cls.name, cls.store_id)
+                                .filter(cls.name.in_([row['name'] for row in chunk])))
+                db.session.execute(statement)
+                results = [(row['name'], existing.get(row['name'], row['store_id']),
+                            row['name'] not in existing) for row in chunk]
+
+            for name, store_id, created in results:
+                statuses[name] = 'created' if created else 'updated'
+                pending_names.append(name)
+                pending_store_ids.add(store_id)
+            if not atomic:
+                cls.bump_versions(pending_store_ids)
+                db.session.commit()
+                cls.invalidate_cache(pending_names, pending_store_ids)
+                pending_names, pending_store_ids = [], set()
+        if pending_names:
+            cls.bump_versions(pending_store_ids)
+        db.session.commit()
+        cls.invalidate_cache(pending_names, pending_store_ids)
+        return statuses
+
+    @staticmethod
+    def version_names(store_ids):
+        """
+        The data versions a write to items in the given stores changes. The version of
+        all the items follows, see DataVersionModel.
+        :param store_ids: the ids of the items' stores, before and after the write.
+        :return:
+        """
+        return [DataVersionModel.store_key(store_id) for store_id in store_ids]
+
+    @classmethod
+    def bump_versions(cls, store_ids):
+        """
+        Increments the versions of the given stores, in the current transaction.
+        Must be called right before the commit of every write to items.
+        :param store_ids: the ids of the items' stores, before and after the write.
+        """
+        DataVersionModel.bump(*cls.version_names(store_ids))
+
+    @classmethod
+    def invalidate_cache(cls, names, store_ids):
+        """
+        Drops the cached JSON of items and of the stores that embed them.
+        Must be called after every committed write to items.
+        :param names: the item names.
+        :param store_ids: the ids of the items' stores, before and after the write.
+        """
+        for name in names:
+            item_cache.invalidate(name)
+        store_ids = set(store_ids)
+        store_cache.invalidate_where(lambda store: store['id'] in store_ids)
@@ -2,7 +2,14 @@
 MODELS/STORE
 This module consists of the StoreModel.
 """
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload, subqueryload
+
+from cache import item_cache, store_cache
 from db import db
+from models.item import ItemModel
+from models.version import DataVersionModel
+from pagination import paginate
 
 
 class StoreModel(db.Model):
@@ -12,21 +19,90 @@ class StoreModel(db.Model):
     __tablename__ = "stores"
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(80))
+    name = db.Column(db.String(80), unique=True, index=True)
+
+    # Ordered by id like merge_json(), whichever index of items the database picks.
+    items = db.relationship('ItemModel', back_populates='store', order_by='ItemModel.id')
 
-    items = db.relationship('ItemModel', lazy='dynamic')
+    # The fields of json(), in order, that ?fields= picks from. items.<field> picks the
+    # fields of the embedded items, see ItemModel.FIELDS.
+    FIELDS = ('id', 'name') + tuple('items.' + field for field in ItemModel.FIELDS)
 
     def __init__(self, name):
         self.name = name
 
-    def json(self):
+    def json(self, items=None):
         """
         Returns the JSON in dict format.
+        :param items: the items already in JSON format, defaults to self.items.
         :return:
         """
+        if items is None:
+            items = [item.json() for item in self.items]
         return {'id': self.id,
                 'name': self.name,
-                'items': [item.json() for item in self.items.all()]}
+                'items': items}
+
+    @classmethod
+    def load_fields(cls, fields=None):
+        """
+        Returns the query of rows of the given store fields, and of the id the items are
+        matched on, see merge_json().
+        :param fields: the store fields to select, defaults to id and name.
+        :return:
+        """
+        return db.session.query(cls.id, *[getattr(cls, field) for field in fields or ('name',) if field != 'id'])
+
+    @staticmethod
+    def row_json(row, fields=None, items=None):
+        """
+        Returns a row of load_fields() in dict format.
+        :param row:
+        :param fields: the fields load_fields() selected.
+        :param items: the items in JSON format, None leaves them out.
+        :return:
+        """
+        json = {field: getattr(row, field) for field in fields or ('id', 'name')}
+        if items is not None:
+            json['items'] = items
+        return json
+
+    @classmethod
+    def merge_json(cls, stores, items, fields=None, item_fields=None):
+        """
+        Yields stores in JSON format with their items, matched like a merge join: stores
+        must be ordered by id and items by store_id, so only the items of the current
+        store are held at once.
+        :param stores: rows of load_fields().
+        :param items: an iterator of rows of ItemModel.load_fields(item_fields, store_id),
+            or None to leave the items out.
+        :param fields: the store fields.
+        :param item_fields: the item fields.
+        :return:
+        """
+        item = None if items is None else next(items, None)
+        for store in stores:
+            if items is None:
+                yield cls.row_json(store, fields)
+                continue
+            store_items = []
+            # Items pointing at a store that no longer exists are skipped, as in json().
+            while item is not None and item.store_id <= store.id:
+                if item.store_id == store.id:
+                    store_items.append(ItemModel.row_json(item, item_fields))
+                item = next(items, None)
+            yield cls.row_json(store, fields, store_items)
+
+    @classmethod
+    def item_rows(cls, item_fields=None):
+        """
+        Returns the query of rows of the given item fields of the items that have a store,
+        ordered for merge_json().
+        :param item_fields: defaults to ItemModel.FIELDS.
+        :return:
+        """
+        return (ItemModel.load_fields(item_fields or ItemModel.FIELDS, ItemModel.store_id)
+                .filter(ItemModel.store_id.isnot(None)).order_by(ItemModel.store_id, ItemModel.id))
 
     @classmethod
     def find_by_name(cls, name):
@@ -35,27 +111,189 @@ class StoreModel(db.Model):
         :param name:
         :return:
         """
-        return cls.query.filter_by(name=name).first()
+        return cls.query.options(selectinload(cls.items)).filter_by(name=name).first()
+
+    @classmethod
+    def find_json_by_name(cls, name, versions=None):
+        """
+        Returns the JSON of the store called name, or None, read through store_cache.
+        :param name:
+        :param versions: the current data versions of the store, if known. They are part of
+            the cache key, so entries written before a change in another process are skipped.
+        :return:
+        """
+        def load():
+            store = cls.find_by_name(name)
+            return store.json() if store else None
+        return store_cache.get_or_load((name, versions), load)
+
+    @classmethod
+    def find_id_by_name(cls, name):
+        """
+        Returns the id of the store called name, or None, without loading its items.
+        :param name:
+        :return:
+        """
+        return db.session.query(cls.id).filter_by(name=name).scalar()
+
+    @classmethod
+    def find_existing_ids(cls, ids):
+        """
+        Returns the subset of ids that belong to a store, in one query.
+        :param ids:
+        :return:
+        """
+        return {store_id for store_id, in db.session.query(cls.id).filter(cls.id.in_(set(ids)))}
+
+    @classmethod
+    def find_fields_by_name(cls, name, fields=None):
+        """
+        Returns the JSON of the store called name without its items, or None. Only the
+        given fields are selected: the items are neither loaded nor read from the cache.
+        :param name:
+        :param fields: the store fields to return, defaults to id and name.
+        :return:
+        """
+        row = cls.load_fields(fields).filter(cls.name == name).first()
+        return cls.row_json(row, fields) if row else None
 
     @classmethod
     def find_all(cls):
         """
+        Loads every store together with its items in two queries, however many stores
+        there are. subqueryload is used rather than selectinload, which splits its
+        IN (...) list into batches of 500 stores.
+        :return:
+        """
+        return cls.query.options(subqueryload(cls.items)).all()
 
+    @classmethod
+    def iter_json(cls, chunk_size, fields=None, item_fields=None, embed=True):
+        """
+        Yields every store in JSON format without loading the tables into memory.
+        Stores ordered by id and items ordered by store_id are both read chunk_size rows
+        at a time (server-side cursors on PostgreSQL) and merged, see merge_json(), in
+        two queries. Only the given fields are read, as rows rather than models.
+        :param chunk_size:
+        :param fields: the store fields, defaults to id and name.
+        :param item_fields: the item fields, defaults to ItemModel.FIELDS.
+        :param embed: whether to return the items, without them it is one query.
+        :return:
+        """
+        stores = cls.load_fields(fields).order_by(cls.id).yield_per(chunk_size)
+        items = iter(cls.item_rows(item_fields).yield_per(chunk_size)) if embed else None
+        return cls.merge_json(stores, items, fields, item_fields or ItemModel.FIELDS)
+
+    @classmethod
+    def find_page(cls, limit, cursor=None):
+        """
+        Returns a (stores, next_cursor) page of stores ordered by id, with their items.
+        :param limit: the page size.
+        :param cursor: the cursor of the previous page.
+        :return:
+        """
+        return paginate(cls.query.options(subqueryload(cls.items)), cls.id, limit, cursor)
+
+    @classmethod
+    def find_fields_page(cls, limit, cursor=None, fields=None, item_fields=None, embed=True):
+        """
+        Returns a (stores, next_cursor) page of stores ordered by id, in JSON format with
+        only the given fields, see iter_json(). Two queries, one without embed.
+        :param limit: the page size.
+        :param cursor: the cursor of the previous page.
+        :param fields: the store fields, defaults to id and name.
+        :param item_fields: the item fields, defaults to ItemModel.FIELDS.
+        :param embed: whether to return the items.
+        :return:
+        """
+        stores, next_cursor = paginate(cls.load_fields(fields), cls.id, limit, cursor)
+        items = None
+        if embed:
+            items = iter(cls.item_rows(item_fields).filter(ItemModel.store_id.in_([store.id for store in stores])))
+        return list(cls.merge_json(stores, items, fields, item_fields or ItemModel.FIELDS)), next_cursor
+
+    @classmethod
+    def summary_query(cls):
+        """
+        Returns the query of the item count and the min, max and average item price of
+        every store, grouped by the database: no item is loaded. Stores without items
+        count 0 and have null prices. On SQLite the (store_id, price) index of items
+        covers the aggregates, so the items table itself is never read.
+        :return:
+        """
+        return (db.session.query(cls.id, cls.name,
+                                 func.count(ItemModel.id).label('item_count'),
+                                 func.min(ItemModel.price).label('min_price'),
+                                 func.max(ItemModel.price).label('max_price'),
+                                 func.avg(ItemModel.price).label('avg_price'))
+                .outerjoin(ItemModel, ItemModel.store_id == cls.id)
+                .group_by(cls.id, cls.name))
+
+    @staticmethod
+    def summary_json(row):
+        """
+        Returns a row of summary_query() in dict format.
+        :param row:
+        :return:
+        """
+        return {'id': row.id,
+                'name': row.name,
+                'item_count': row.item_count,
+                'min_price': row.min_price,
+                'max_price': row.max_price,
+                'avg_price': row.avg_price}
+
+    @classmethod
+    def find_summary_by_name(cls, name):
+        """
+        Returns the summary of the store called name in dict format, or None.
+        :param name:
+        :return:
+        """
+        row = cls.summary_query().filter(cls.name == name).first()
+        return cls.summary_json(row) if row else None
+
+    @classmethod
+    def find_summaries(cls):
+        """
+        Returns the summary of every store in dict format, ordered by id.
+        :return:
+        """
+        return [cls.summary_json(row) for row in cls.summary_query().order_by(cls.id)]
+
+    @classmethod
+    def find_summary_page(cls, limit, cursor=None):
+        """
+        Returns a (summaries, next_cursor) page of store summaries ordered by id.
+        :param limit: the page size.
+        :param cursor: the cursor of the previous page.
         :return:
         """
-        return cls.query.all()
+        rows, next_cursor = paginate(cls.summary_query(), cls.id, limit, cursor)
+        return [cls.summary_json(row) for row in rows], next_cursor
 
     def save_to_db(self):
         """
         An internal model function that inserts data into database.
         """
         # Add the new item to current list of items (or the database if it exists)
+        name = self.name
         db.session.add(self)
+        # Flush first, a new store has no id before that.
+        db.session.flush()
+        DataVersionModel.bump('stores', DataVersionModel.store_key(self.id))
         db.session.commit()
+        store_cache.invalidate_where(lambda store: store['name'] == name)
 
     def delete_from_db(self):
         """
         An internal Item model method to update the database upon user's PUT request.
         """
+        name, store_id = self.name, self.id
         db.session.delete(self)
+        # The items of the store are detached from it too, the store's version covers them.
+        DataVersionModel.bump('stores', DataVersionModel.store_key(store_id))
         db.session.commit()
+        store_cache.invalidate_where(lambda store: store['name'] == name)
+        # Deleting a store detaches its items (store_id becomes NULL).
+        item_cache.invalidate_where(lambda item: item['store_id'] == store_id)
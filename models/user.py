@@ -2,6 +2,7 @@
 MODELS/USER
 This module consists of the UserModel.
 """
+from cache import identity_cache
 from db import db
 
 
@@ -13,7 +14,7 @@ class UserModel(db.Model):
     __tablename__ = "users"
 
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80))
+    username = db.Column(db.String(80), unique=True, index=True)
     password = db.Column(db.String(80))
 
     def __init__(self, username, password):
@@ -29,15 +30,20 @@ class UserModel(db.Model):
         """
         An internal model function that inserts data into database.
         """
+        user_id = self.id
         db.session.add(self)
         db.session.commit()
+        if user_id is not None:
+            identity_cache.invalidate(user_id)
 
     def delete_from_db(self):
         """
         An internal model function that deletes data from database.
         """
+        user_id = self.id
         db.session.delete(self)
         db.session.commit()
+        identity_cache.invalidate(user_id)
 
     @classmethod
     def find_by_username(cls, username):
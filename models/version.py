@@ -0,0 +1,78 @@
+"""
+MODELS/VERSION
+This module consists of the DataVersionModel.
+"""
+from sqlalchemy import func, literal, select, union_all
+
+from db import db, upsert_insert
+
+# The prefix of the per-store versions, and the first name past them: ':' + 1 is ';'.
+STORE_PREFIX = 'store:'
+STORE_PREFIX_END = 'store;'
+
+
+class DataVersionModel(db.Model):
+    """
+    A counter per data set ('stores', 'store:<id>') that every write to the data set
+    increments in the same transaction. The API derives its ETags from them.
+    The version of all the items ('items') has no row of its own: it is the sum of the
+    per-store versions, which every item write increments. A write thus only locks the
+    rows of its own stores, instead of one row every item write would queue on.
+    """
+    __tablename__ = "data_versions"
+
+    name = db.Column(db.String(80), primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
+    @staticmethod
+    def store_key(store_id):
+        """
+        The name of the version of a single store and its items. store_id None stands
+        for the items without a store.
+        :param store_id:
+        :return:
+        """
+        return STORE_PREFIX + str(store_id)
+
+    @classmethod
+    def bump_statement(cls, names, dialect_name=None):
+        """
+        Returns the INSERT ... ON CONFLICT DO UPDATE that increments the given versions.
+        :param names: the names of the versions.
+        :param dialect_name: defaults to the dialect of db.engine.
+        :return:
+        """
+        table = cls.__table__
+        statement = upsert_insert(table, dialect_name).values(
+            [{'name': name, 'version': 1} for name in sorted(set(names))])
+        return statement.on_conflict_do_update(index_elements=[table.c.name],
+                                               set_={'version': table.c.version + 1})
+
+    @classmethod
+    def bump(cls, *names):
+        """
+        Increments the given versions in the current transaction. Call it right before
+        the commit of a write: on PostgreSQL the row stays locked until then.
+        :param names: the names of the versions, None entries are ignored.
+        """
+        names = [name for name in names if name is not None]
+        if names:
+            db.session.execute(cls.bump_statement(names))
+
+    @classmethod
+    def find_versions(cls, names):
+        """
+        Returns the current version of every name (0 if it was never written), in one query.
+        :param names:
+        :return:
+        """
+        versions = dict.fromkeys(names, 0)
+        statement = select(cls.name, cls.version).where(cls.name.in_(versions))
+        if 'items' in versions:
+            # A range on the primary key, which LIKE 'store:%' wouldn't use everywhere.
+            stores = (select(literal('items'), func.coalesce(func.sum(cls.version), 0))
+                      .where(cls.name >= STORE_PREFIX, cls.name < STORE_PREFIX_END))
+            statement = union_all(statement, stores)
+        for name, version in db.session.execute(statement):
+            versions[name] += version
+        return versions
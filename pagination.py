@@ -0,0 +1,137 @@
+"""
+PAGINATION
+Keyset (cursor) pagination for the list resources.
+"""
+import base64
+import json
+import math
+import numbers
+
+from flask_restful import reqparse, inputs
+from sqlalchemy import tuple_
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def page_limit(value):
+    """
+    A reqparse type for the limit argument.
+    :param value:
+    :return:
+    """
+    limit = int(value)
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError("limit must be between 1 and {}.".format(MAX_LIMIT))
+    return limit
+
+
+# The query string arguments every paginated list resource accepts.
+pagination_parser = reqparse.RequestParser()
+pagination_parser.add_argument('limit', type=page_limit, location='args', default=DEFAULT_LIMIT)
+pagination_parser.add_argument('cursor', type=str, location='args')
+# ?paginate=false returns the whole table in the original, unpaginated shape.
+pagination_parser.add_argument('paginate', type=inputs.boolean, location='args', default=True)
+# ?stream=true streams the whole list in the unpaginated shape, see streaming.py.
+pagination_parser.add_argument('stream', type=inputs.boolean, location='args', default=False)
+
+
+def encode_cursor(value):
+    """
+    Turns the key of the last row of a page into an opaque cursor.
+    :param value:
+    :return:
+    """
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Reverses encode_cursor. Raises ValueError for anything it didn't produce.
+    :param cursor:
+    :return:
+    """
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+
+def valid_key(column, value):
+    """
+    Whether a decoded cursor value can be compared with column: a finite number for a
+    numeric column, an int for an integer one, a string for a string one.
+    :param column:
+    :param value:
+    :return:
+    """
+    if value is None or isinstance(value, (bool, list, dict)):
+        return False
+    if isinstance(value, float) and not math.isfinite(value):
+        return False
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return True
+    if issubclass(python_type, numbers.Number) and python_type is not int:
+        return isinstance(value, (int, float))
+    return isinstance(value, python_type)
+
+
+def page_query(query, column, limit, cursor=None, descending=False):
+    """
+    Returns query restricted to one page ordered by column, which must be unique.
+    Rows are found with WHERE column > :last ORDER BY column LIMIT n, so every page
+    costs an index seek instead of the OFFSET scan that grows with the page number.
+    column can also be a list of columns whose values are unique together, e.g.
+    [price, id]: the page then starts after the row value (:price, :id).
+    Works on ORM queries and on select() statements alike.
+    :param query: the query to paginate.
+    :param column: the unique, indexed column (or list of columns) to paginate on.
+    :param limit: the page size.
+    :param cursor: the cursor returned with the previous page, if any.
+    :param descending: paginate from the largest key down.
+    :return:
+    """
+    columns = column if isinstance(column, (list, tuple)) else [column]
+    if cursor is not None:
+        last = decode_cursor(cursor)
+        # A single column has a plain value as its cursor, several a list of them.
+        last = last if len(columns) > 1 else [last]
+        if (not isinstance(last, list) or len(last) != len(columns)
+                or not all(valid_key(c, value) for c, value in zip(columns, last))):
+            raise ValueError("Invalid cursor.")
+        key = tuple_(*columns) if len(columns) > 1 else columns[0]
+        value = tuple_(*last) if len(columns) > 1 else last[0]
+        query = query.filter(key < value if descending else key > value)
+    # One extra row tells whether there is a next page.
+    return query.order_by(*[c.desc() if descending else c for c in columns]).limit(limit + 1)
+
+
+def page_result(rows, column, limit):
+    """
+    Splits the rows of a page_query() into the page and the cursor of the next one.
+    :param rows:
+    :param column: the column, or list of columns, passed to page_query().
+    :param limit:
+    :return: a (rows, next_cursor) tuple, next_cursor is None on the last page.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    columns = column if isinstance(column, (list, tuple)) else [column]
+    last = [getattr(rows[-1], c.key) for c in columns]
+    return rows, encode_cursor(last if len(columns) > 1 else last[0])
+
+
+def paginate(query, column, limit, cursor=None, descending=False):
+    """
+    Returns one page of query ordered by column, see page_query().
+    :param query: the query to paginate.
+    :param column: the unique, indexed column (or list of columns) to paginate on.
+    :param limit: the page size.
+    :param cursor: the cursor returned with the previous page, if any.
+    :param descending: paginate from the largest key down.
+    :return: a (rows, next_cursor) tuple, next_cursor is None on the last page.
+    """
+    return page_result(page_query(query, column, limit, cursor, descending).all(), column, limit)
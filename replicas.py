@@ -0,0 +1,73 @@
+"""
+REPLICAS
+Sends the reads of GET requests to the read replicas in DATABASE_REPLICA_URLS, see
+db.RoutingSession. Writes, /auth, and the requests of a client that wrote less than
+REPLICA_STICKY_SECONDS ago stay on the primary, so clients read their own writes
+whatever the replication lag.
+"""
+import time
+
+from flask import g, request
+
+from db import REPLICA_BIND_PREFIX, db
+
+DEFAULT_STICKY_SECONDS = 5.0
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Holds the time until which the client's requests read from the primary.
+STICKY_COOKIE = 'db_primary_until'
+
+
+def is_auth(app):
+    """
+    Whether the current request is Flask-JWT's /auth, which always uses the primary:
+    it checks the password of users that may have registered a moment ago.
+    :param app:
+    :return:
+    """
+    return request.path == app.config.get('JWT_AUTH_URL_RULE', '/auth')
+
+
+def is_sticky():
+    """
+    Whether the client of the current request wrote less than REPLICA_STICKY_SECONDS ago.
+    :return:
+    """
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def init_app(app):
+    """
+    Adds a bind per URL of DATABASE_REPLICA_URLS and routes the reads of safe requests to
+    one of them. Without replicas, nothing is installed.
+    :param app:
+    """
+    urls = app.config.setdefault('DATABASE_REPLICA_URLS', [])
+    app.config.setdefault('REPLICA_STICKY_SECONDS', DEFAULT_STICKY_SECONDS)
+    if not urls:
+        return
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds.update({'{}{}'.format(REPLICA_BIND_PREFIX, index): url for index, url in enumerate(urls)})
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+    @app.before_request
+    def route_reads():
+        if request.method not in SAFE_METHODS or is_auth(app):
+            return
+        if is_sticky():
+            # Also tells the caches to skip entries that may come from a replica.
+            g.db_read_primary = True
+            return
+        # db.session is a scoped_session, calling it returns the request's RoutingSession.
+        db.session().use_replica()
+
+    @app.after_request
+    def stick_to_primary(response):
+        seconds = app.config['REPLICA_STICKY_SECONDS']
+        if (seconds and request.method not in SAFE_METHODS and not is_auth(app)
+                and response.status_code < 400):
+            response.set_cookie(STICKY_COOKIE, '{:.3f}'.format(time.time() + seconds),
+                                max_age=int(seconds) + 1, httponly=True)
+        return response
@@ -1,10 +1,32 @@
 """
 ITEM
 """
+import math
 
-from flask_restful import Resource, reqparse
+from flask import current_app, request
+from flask_restful import Resource, reqparse, inputs
 from flask_jwt import jwt_required
+from sqlalchemy.exc import IntegrityError
 from models.item import ItemModel
+from models.store import StoreModel
+from db import db
+from conditional import conditional
+from fieldsets import add_fields_arguments, select_fields
+from pagination import pagination_parser
+from search import search_term
+from streaming import chunk_size, stream_json_list
+
+
+def finite_float(value):
+    """
+    A reqparse type for prices: float() also parses "nan" and "inf", which no item can cost.
+    :param value:
+    :return:
+    """
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError("{} is not a finite number.".format(value))
+    return number
 
 
 class Item(Resource):
@@ -13,24 +35,29 @@ class Item(Resource):
     """
     parser = reqparse.RequestParser()
     parser.add_argument('price',
-                        type=float,
+                        type=finite_float,
                         required=True,
                         help="This field cannot be left blank!")
     parser.add_argument('store_id',
                         type=int,
                         required=True,
                         help="Every item needs a store ID.")
+    # The query string of GET, ?fields= picks the fields of the item.
+    query_parser = add_fields_arguments(reqparse.RequestParser(), ItemModel.FIELDS)
 
+    @classmethod
     @jwt_required()
-    def get(self, name):
+    def get(cls, name):
         """
         The async function that handles GET requests.
         :param name: item name to be returned to user.
         :return:
         """
-        item = ItemModel.find_by_name(name)
+        fields = cls.query_parser.parse_args()['fields']
+        # The cached item is a single row, narrowing it costs less than another query.
+        item = ItemModel.find_json_by_name(name)
         if item:
-            return item.json()
+            return select_fields(item, fields)
 
             # If row returns none, 404 status_code is returned with a message.
         return {'message': 'Item not found'}, 404
@@ -42,25 +69,26 @@ class Item(Resource):
         :param name: item name to be created.
         :return:
         """
-
-        # Check whether the request is properly made.
-        if ItemModel.find_by_name(name):
-            return {'message': "An item with name '{}' already exists".format(name)}, 400
-
         # Load data
         request_data = cls.parser.parse_args()
 
-        # Create a new item
-        item = ItemModel(name, **request_data)
-
+        # Create the item unless one with that name exists, in a single statement.
         try:
-            item.save_to_db()
+            item = ItemModel.upsert(name, overwrite=False, **request_data)
+        except IntegrityError:
+            # With foreign keys enforced, the only constraint left to fail is the store.
+            db.session.rollback()
+            return {'message': "Store {} does not exist.".format(request_data['store_id'])}, 400
         except Exception as e:
+            db.session.rollback()
             return {'message': 'An error occured inserting the item. Here is the error {}'.format(
                 e)}, 500  # Internal Server Error
 
+        if item is None:
+            return {'message': "An item with name '{}' already exists".format(name)}, 400
+
         # Return "response" with item and status code 201: CREATED
-        return item.json(), 201
+        return item, 201
 
     def delete(self, name):
         """
@@ -84,30 +112,159 @@ class Item(Resource):
         # Load and parse data
         request_data = cls.parser.parse_args()
 
-        # Check whether name already exists
-        item = ItemModel.find_by_name(name)
-
-        # If name doesn't exist, create. Otherwise, update.
-        if item is None:
-            item = ItemModel(name, **request_data)
-        else:
-            item.price = request_data['price']
-
-        # In either case: insert or update we need to save to db ==> save_to_db()
-        item.save_to_db()
+        # If name doesn't exist, create. Otherwise, update the price. One statement either way.
+        try:
+            item = ItemModel.upsert(name, **request_data)
+        except IntegrityError:
+            db.session.rollback()
+            return {'message': "Store {} does not exist.".format(request_data['store_id'])}, 400
+        except Exception as e:
+            db.session.rollback()
+            return {'message': 'An error occured inserting the item. Here is the error {}'.format(
+                e)}, 500  # Internal Server Error
         # Return item.
-        return item.json()
+        return item
 
 
 class ItemList(Resource):
     """
     A Flask-RestFul Resource object for accessing /items.
     """
+    parser = add_fields_arguments(pagination_parser.copy(), ItemModel.FIELDS)
+    parser.add_argument('min_price', type=float, location='args')
+    parser.add_argument('max_price', type=float, location='args')
+    parser.add_argument('store_id', type=int, location='args')
+    parser.add_argument('sort', choices=ItemModel.SORTS, location='args', default='id')
 
-    def get(self):
+    @classmethod
+    @conditional(lambda cls: ['items'])
+    def get(cls):
         """
         The async function that handles GET requests.
+        Returns a page of items and the cursor of the next page, or every item with
+        ?paginate=false (buffered) or ?stream=true (streamed). ?min_price=, ?max_price=
+        and ?store_id= filter the items, ?sort= orders them (id, -id, price or -price).
+        ?fields= picks the fields of the items, the others aren't read from the database.
         :return:
         """
+        args = cls.parser.parse_args()
+        fields = args['fields']
+        filters = {'min_price': args['min_price'], 'max_price': args['max_price'], 'store_id': args['store_id']}
+        if args['stream']:
+            return stream_json_list('items', (ItemModel.row_json(item, fields) for item in
+                                              ItemModel.iter_all(chunk_size(), args['sort'], fields, **filters)))
+        if not args['paginate']:
+            return {'items': [ItemModel.row_json(item, fields)
+                              for item in ItemModel.find_all(args['sort'], fields, **filters)]}, 200
+
+        try:
+            items, next_cursor = ItemModel.find_page(args['limit'], args['cursor'], args['sort'], fields, **filters)
+        except ValueError as e:
+            return {'message': str(e)}, 400
+        return {'items': [ItemModel.row_json(item, fields) for item in items], 'next': next_cursor}, 200
+
+
+class ItemSearch(Resource):
+    """
+    A Flask-RestFul Resource object for searching items by name at /items/search.
+    """
+    parser = pagination_parser.copy()
+    parser.remove_argument('paginate')
+    parser.remove_argument('stream')
+    parser.add_argument('q', type=search_term, location='args', required=True)
+
+    @classmethod
+    @conditional(lambda cls: ['items'])
+    def get(cls):
+        """
+        The async function that handles GET requests.
+        Returns a page of the items whose name contains ?q=, those starting with it first,
+        and the cursor of the next page.
+        :return:
+        """
+        args = cls.parser.parse_args()
+        try:
+            items, next_cursor = ItemModel.search(args['q'], args['limit'], args['cursor'])
+        except ValueError as e:
+            return {'message': str(e)}, 400
+        return {'items': [item.json() for item in items], 'next': next_cursor}, 200
+
+
+class ItemBulk(Resource):
+    """
+    A Flask-RestFul Resource object for creating or updating many items at once at /items/bulk.
+    """
+    parser = reqparse.RequestParser()
+    # ?atomic=false commits every BULK_CHUNK_SIZE rows instead of once for the whole request.
+    parser.add_argument('atomic', type=inputs.boolean, location='args', default=True)
+
+    @staticmethod
+    def validate(row):
+        """
+        Returns why a row of the request body is invalid, or None.
+        :param row:
+        :return:
+        """
+        if not isinstance(row, dict):
+            return "Every item must be an object."
+        if not isinstance(row.get('name'), str) or not 0 < len(row['name']) <= 80:
+            return "'name' must be a string of 1 to 80 characters."
+        if (isinstance(row.get('price'), bool) or not isinstance(row.get('price'), (int, float))
+                or not math.isfinite(row['price'])):
+            return "'price' must be a number."
+        if isinstance(row.get('store_id'), bool) or not isinstance(row.get('store_id'), int):
+            return "Every item needs a store ID."
+        return None
+
+    @classmethod
+    def post(cls):
+        """
+        The async function that handles POST requests.
+        Takes a list of {name, price, store_id} objects (or {'items': [...]}), validates them
+        in one pass and upserts the valid ones in a single transaction.
+        :return: the outcome of every row, in request order.
+        """
+        args = cls.parser.parse_args()
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('items')
+        if not isinstance(data, list):
+            return {'message': "The body must be a list of items."}, 400
+
+        errors = {}
+        seen = set()
+        for index, row in enumerate(data):
+            error = cls.validate(row)
+            if error is None and row['name'] in seen:
+                error = "The item '{}' appears more than once.".format(row['name'])
+            if error is None:
+                seen.add(row['name'])
+            else:
+                errors[index] = error
+
+        store_ids = StoreModel.find_existing_ids(row['store_id'] for index, row in enumerate(data)
+                                                 if index not in errors)
+        for index, row in enumerate(data):
+            if index not in errors and row['store_id'] not in store_ids:
+                errors[index] = "Store {} does not exist.".format(row['store_id'])
+
+        rows = [{'name': row['name'], 'price': float(row['price']), 'store_id': row['store_id']}
+                for index, row in enumerate(data) if index not in errors]
+        try:
+            statuses = ItemModel.upsert_many(rows, current_app.config.get('BULK_CHUNK_SIZE', 250),
+                                             atomic=args['atomic'])
+        except Exception as e:
+            db.session.rollback()
+            return {'message': 'An error occured inserting the items. Here is the error {}'.format(
+                e)}, 500  # Internal Server Error
 
-        return {'items': [item.json() for item in ItemModel.find_all()]}, 200
+        results = []
+        for index, row in enumerate(data):
+            if index in errors:
+                results.append({'index': index, 'status': 'error', 'message': errors[index]})
+            else:
+                results.append({'index': index, 'name': row['name'], 'status': statuses[row['name']]})
+        return {'results': results,
+                'created': sum(1 for status in statuses.values() if status == 'created'),
+                'updated': sum(1 for status in statuses.values() if status == 'updated'),
+                'errors': len(errors)}, 200
@@ -0,0 +1,27 @@
+"""
+RESOURCES | STATS
+"""
+from flask import current_app
+from flask_restful import Resource
+
+import cache
+from compression import compression_stats
+from db import engine_stats
+from slowlog import slow_query_log
+
+
+class Stats(Resource):
+    """
+    Exposes the runtime counters of this worker process.
+    """
+
+    def get(self):
+        """
+        Returns the hit/miss/eviction counters of every cache, the connection pool state
+        the response compression totals and the slow query counters.
+        :return:
+        """
+        return {'caches': cache.all_stats(),
+                'pool': engine_stats(current_app),
+                'compression': compression_stats.json(),
+                'slow_queries': slow_query_log.json()}
@@ -2,24 +2,65 @@
 RESOURCES | STORE
 """
 
-from flask_restful import Resource
+from flask_restful import Resource, reqparse
+from sqlalchemy.exc import IntegrityError
+from conditional import conditional, current_versions
+from db import db
+from fieldsets import add_fields_arguments, select_fields, split_fields
 from models.store import StoreModel
+from models.version import DataVersionModel
+from pagination import pagination_parser
+from streaming import chunk_size, stream_json_list
+
+
+def store_versions(resource, name):
+    """
+    The data versions /store/<name> depends on, or None if there is no such store.
+    :param resource:
+    :param name:
+    :return:
+    """
+    store_id = StoreModel.find_id_by_name(name)
+    if store_id is None:
+        return None
+    return [DataVersionModel.store_key(store_id)]
+
+
+def fieldset_args(args):
+    """
+    Splits the parsed ?fields= and ?embed= of a store resource.
+    :param args: the arguments parsed by a parser of add_fields_arguments().
+    :return: a (fields, item_fields, embed) tuple, see StoreModel.iter_json().
+    """
+    fields, item_fields = split_fields(args['fields'], 'items')
+    return fields, item_fields, args['embed'] == 'items'
 
 
 class Store(Resource):
     """
     Bla bla
     """
+    # The query string of GET, ?fields= and ?embed=items|none shape the store.
+    query_parser = add_fields_arguments(reqparse.RequestParser(), StoreModel.FIELDS, embed=True)
 
+    @conditional(store_versions)
     def get(self, name):
         """
 
         :param name:
         :return:
         """
-        store = StoreModel.find_by_name(name)
+        fields, item_fields, embed = fieldset_args(self.query_parser.parse_args())
+        if not embed:
+            # Without the items, a one row query beats loading them through the cache.
+            store = StoreModel.find_fields_by_name(name, fields)
+        else:
+            store = StoreModel.find_json_by_name(name, current_versions())
+            if store and (fields or item_fields):
+                items = [select_fields(item, item_fields) for item in store['items']]
+                store = dict(select_fields(store, fields or ('id', 'name')), items=items)
         if store:
-            return store.json()
+            return store
         return {'message': 'Store not found'}, 404
 
     def post(self, name):
@@ -29,8 +70,13 @@ class Store(Resource):
 
         try:
             store.save_to_db()
-        except:
-            {'message': 'An error occured while creating the store.'}, 500
+        except IntegrityError:
+            # Another request created the store since the lookup above.
+            db.session.rollback()
+            return {'message': "A store with name '{}' already exists.".format(name)}, 400
+        except Exception:
+            db.session.rollback()
+            return {'message': 'An error occured while creating the store.'}, 500
 
         return store.json(), 201
 
@@ -42,13 +88,85 @@ class Store(Resource):
         return {'message': 'Store deleted'}
 
 
+class StoreSummary(Resource):
+    """
+    A Flask-RestFul Resource object for the item count and price statistics of a store,
+    at /store/<name>/summary.
+    """
+
+    @conditional(store_versions)
+    def get(self, name):
+        """
+        Returns the number of items of the store and their min, max and average price.
+        :param name:
+        :return:
+        """
+        summary = StoreModel.find_summary_by_name(name)
+        if summary:
+            return summary
+        return {'message': 'Store not found'}, 404
+
+
 class StoreList(Resource):
     """
     StoreList class.
     """
-    def get(self):
+    parser = add_fields_arguments(pagination_parser.copy(), StoreModel.FIELDS, embed=True)
+
+    @classmethod
+    @conditional(lambda cls: ['stores', 'items'])
+    def get(cls):
         """
         Get method for the list of stores.
+        Returns a page of stores and the cursor of the next page, or every store with
+        ?paginate=false (buffered) or ?stream=true (streamed). ?fields= picks the fields
+        of the stores and of their items (items.<field>), ?embed=none leaves the items
+        out: what isn't returned isn't read from the database either.
         :return:
         """
-        return {'stores': [store.json() for store in StoreModel.find_all()]}
+        args = cls.parser.parse_args()
+        shape = fieldset_args(args)
+        narrowed = shape != (None, None, True)
+        if args['stream']:
+            return stream_json_list('stores', StoreModel.iter_json(chunk_size(), *shape))
+        if not args['paginate']:
+            if narrowed:
+                return {'stores': list(StoreModel.iter_json(chunk_size(), *shape))}
+            return {'stores': [store.json() for store in StoreModel.find_all()]}
+
+        try:
+            if narrowed:
+                stores, next_cursor = StoreModel.find_fields_page(args['limit'], args['cursor'], *shape)
+            else:
+                stores, next_cursor = StoreModel.find_page(args['limit'], args['cursor'])
+                stores = [store.json() for store in stores]
+        except ValueError as e:
+            return {'message': str(e)}, 400
+        return {'stores': stores, 'next': next_cursor}
+
+
+class StoreSummaryList(Resource):
+    """
+    A Flask-RestFul Resource object for the summaries of every store, at /stores/summary.
+    """
+    parser = pagination_parser.copy()
+    # A summary is one row per store, the whole list is buffered cheaply.
+    parser.remove_argument('stream')
+
+    @classmethod
+    @conditional(lambda cls: ['stores', 'items'])
+    def get(cls):
+        """
+        Returns a page of store summaries, see StoreSummary, and the cursor of the next
+        page, or every summary with ?paginate=false.
+        :return:
+        """
+        args = cls.parser.parse_args()
+        if not args['paginate']:
+            return {'stores': StoreModel.find_summaries()}
+
+        try:
+            summaries, next_cursor = StoreModel.find_summary_page(args['limit'], args['cursor'])
+        except ValueError as e:
+            return {'message': str(e)}, 400
+        return {'stores': summaries, 'next': next_cursor}
@@ -3,15 +3,57 @@ RUN |
 The script to run the app without issues.
 """
 
-from app import app
-from db import db
+import atexit
+import os
 
-db.init_app(app)
+from app import create_app, warm_up
+from db import dispose_engines, init_db
+from metrics import mark_worker_dead
 
+app = create_app()
 
-@app.before_first_request
-def create_tables():
+
+def reset_connections():
+    """
+    Drops the connections inherited from the parent process, see dispose_engines().
+    Cheap and without queries, so it can run after any fork: new connections are
+    only opened when the child needs one.
+    """
+    dispose_engines(app)
+
+
+def init_worker():
+    """
+    Runs in every uwsgi worker before it accepts requests: resets the connections,
+    warms the worker up and drops its gauge samples when it exits, see
+    mark_worker_dead().
     """
-    Create tables.
+    reset_connections()
+    warm_up(app)
+    atexit.register(mark_worker_dead)
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """
+    Creates the missing tables and indexes.
     """
-    db.create_all()
+    created = init_db(app)
+    print('Created indexes: {}'.format(', '.join(created) or 'none'))
+
+
+# The uwsgi master imports this module once and forks the workers from it, so the
+# schema is checked and the compiled statements are shared by all of them.
+if os.environ.get('INIT_DB', 'true').lower() in ('1', 'true', 'yes'):
+    init_db(app)
+warm_up(app)
+
+try:
+    # uwsgi forks its workers from the master, which imported this module.
+    from uwsgidecorators import postfork
+except ImportError:
+    # Not running under uwsgi. Every fork, including multiprocessing children and
+    # subprocess helpers, only gets its connections reset, and stays lazy otherwise.
+    os.register_at_fork(after_in_child=reset_connections)
+else:
+    postfork(init_worker)
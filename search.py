@@ -0,0 +1,153 @@
+"""
+SEARCH
+Substring search on item names. SQLite databases get an FTS5 table with the
+trigram tokenizer, PostgreSQL databases a pg_trgm GIN index on items.name, both
+kept in sync by the database itself. Without them, searches fall back to LIKE.
+"""
+import logging
+import threading
+import weakref
+
+from sqlalchemy import column, inspect, select, table
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'items_search'
+TRIGRAM_INDEX = 'ix_items_name_trgm'
+# Trigram indexes can't help shorter search terms.
+MIN_TRIGRAM_LENGTH = 3
+MAX_TERM_LENGTH = 80
+
+# An external content table: it only indexes items.name, the triggers keep it in sync
+# with every write, including upserts and bulk inserts that bypass the models.
+SQLITE_SEARCH_TABLE = ("CREATE VIRTUAL TABLE IF NOT EXISTS items_search "
+                       "USING fts5(name, content='items', content_rowid='id', tokenize='trigram')")
+SQLITE_SEARCH_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS items_search_insert AFTER INSERT ON items BEGIN "
+    "INSERT INTO items_search(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS items_search_delete AFTER DELETE ON items BEGIN "
+    "INSERT INTO items_search(items_search, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS items_search_update AFTER UPDATE OF name ON items BEGIN "
+    "INSERT INTO items_search(items_search, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO items_search(rowid, name) VALUES (new.id, new.name); END",
+]
+POSTGRES_SEARCH_INDEX = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_items_name_trgm ON items USING gin (name gin_trgm_ops)",
+]
+
+# The strategy of every engine, see search_strategy().
+_strategies = weakref.WeakKeyDictionary()
+_strategies_lock = threading.Lock()
+
+
+def create_search_index(engine):
+    """
+    Creates the search index of engine's database if it is missing. On SQLite, a search
+    table whose triggers are gone (items was dropped and recreated) is rebuilt.
+    Databases that can't have one (no FTS5, no permission to create pg_trgm) are left
+    alone and keep searching with LIKE.
+    :param engine:
+    :return: the name of the index if it was created or rebuilt, else None.
+    """
+    dialect = engine.dialect.name
+    try:
+        with engine.begin() as connection:
+            if dialect == 'sqlite':
+                triggers = connection.exec_driver_sql(
+                    "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN "
+                    "('items_search_insert', 'items_search_delete', 'items_search_update')").all()
+                if len(triggers) == len(SQLITE_SEARCH_TRIGGERS):
+                    return None
+                connection.exec_driver_sql(SQLITE_SEARCH_TABLE)
+                for trigger in SQLITE_SEARCH_TRIGGERS:
+                    connection.exec_driver_sql(trigger)
+                # Indexes the rows written before the triggers existed.
+                connection.exec_driver_sql("INSERT INTO items_search(items_search) VALUES ('rebuild')")
+                created = SEARCH_TABLE
+            elif dialect == 'postgresql':
+                if any(index['name'] == TRIGRAM_INDEX for index in inspect(connection).get_indexes('items')):
+                    return None
+                for statement in POSTGRES_SEARCH_INDEX:
+                    connection.exec_driver_sql(statement)
+                created = TRIGRAM_INDEX
+            else:
+                return None
+    except DBAPIError as e:
+        logger.warning("Could not create the search index, searches will use LIKE: %s", e.orig)
+        return None
+    with _strategies_lock:
+        _strategies.pop(engine, None)
+    return created
+
+
+def search_strategy(engine):
+    """
+    How engine's database is searched: 'fts5', 'trigram' or 'like'. Looked up once per engine.
+    :param engine:
+    :return:
+    """
+    strategy = _strategies.get(engine)
+    if strategy is not None:
+        return strategy
+    strategy = 'like'
+    if engine.dialect.name == 'sqlite' and inspect(engine).has_table(SEARCH_TABLE):
+        strategy = 'fts5'
+    elif engine.dialect.name == 'postgresql' and any(
+            index['name'] == TRIGRAM_INDEX for index in inspect(engine).get_indexes('items')):
+        strategy = 'trigram'
+    with _strategies_lock:
+        _strategies[engine] = strategy
+    return strategy
+
+
+def search_term(value):
+    """
+    A reqparse type for the q argument.
+    :param value:
+    :return:
+    """
+    term = str(value).strip()
+    if not 0 < len(term) <= MAX_TERM_LENGTH:
+        raise ValueError("q must be between 1 and {} characters.".format(MAX_TERM_LENGTH))
+    return term
+
+
+def like_pattern(term, prefix_only=False):
+    """
+    The LIKE pattern of term, with its wildcards escaped by a backslash.
+    :param term:
+    :param prefix_only: match names starting with term rather than containing it.
+    :return:
+    """
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%' if prefix_only else '%' + escaped + '%'
+
+
+def fts5_phrase(term):
+    """
+    term as an FTS5 phrase: with the trigram tokenizer, it matches names containing term.
+    :param term:
+    :return:
+    """
+    return '"{}"'.format(term.replace('"', '""'))
+
+
+def contains(id_column, name_column, term, strategy):
+    """
+    The condition matching the names that contain term, ignoring case.
+    The LIKE always applies: the index only narrows down the rows it is checked on.
+    :param id_column: items.id.
+    :param name_column: items.name.
+    :param term:
+    :param strategy: see search_strategy().
+    :return:
+    """
+    condition = name_column.ilike(like_pattern(term), escape='\\')
+    if strategy == 'fts5' and len(term) >= MIN_TRIGRAM_LENGTH:
+        index = table(SEARCH_TABLE, column('rowid'), column(SEARCH_TABLE))
+        matches = select(index.c.rowid).where(index.c[SEARCH_TABLE].op('MATCH')(fts5_phrase(term)))
+        condition = id_column.in_(matches) & condition
+    # pg_trgm serves the ILIKE itself.
+    return condition
@@ -3,6 +3,9 @@ SECURITY
 """
 
 from werkzeug.security import safe_str_cmp
+
+from cache import identity_cache
+from db import db
 from models.user import UserModel
 
 
@@ -18,11 +21,28 @@ def authenticate(username, password):
         return user
 
 
-def identity(payload):
+def _load_identity(user_id):
+    """
+    Loads a user and detaches it from the session so it can be cached across requests.
+    :param user_id:
+    :return:
     """
+    user = UserModel.find_by_id(user_id)
+    if user:
+        db.session.expunge(user)
+    return user
 
+
+def identity(payload):
+    """
+    Resolves the user of a JWT, through identity_cache so that protected requests
+    don't need a query each.
     :param payload:
     :return:
     """
     user_id = payload['identity']
-    return UserModel.find_by_id(user_id)
+    user = identity_cache.get_or_load(user_id, lambda: _load_identity(user_id))
+    if user is None:
+        return None
+    # Attach a copy to this request's session without querying the database.
+    return db.session.merge(user, load=False)
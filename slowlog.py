@@ -0,0 +1,213 @@
+"""
+SLOWLOG
+Logs the statements that take longer than SLOW_QUERY_MS, with redacted bind
+parameters and the resource that issued them. The first time a statement shape
+is slow, its EXPLAIN (PostgreSQL) or EXPLAIN QUERY PLAN (SQLite) is logged too.
+Every app has its own threshold and counters, in app.extensions['slowlog'].
+"""
+import json
+import logging
+import re
+import threading
+import time
+
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.local import LocalProxy
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD_MS = 250
+# Bounds the memory of the shapes whose plan was already captured.
+MAX_SHAPES = 1000
+EXPLAIN_PREFIXES = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}
+EXPLAIN_SAVEPOINT = 'slowlog_explain'
+
+# Expanded IN lists, e.g. "IN (?, ?, ?)" or "IN (%(id_1_1)s, %(id_1_2)s)".
+IN_LIST = re.compile(r'\((\s*(\?|%\(\w+\)s|%s)\s*,)+\s*(\?|%\(\w+\)s|%s)\s*\)')
+# The rows of a multi-row VALUES, once IN_LIST collapsed each of them.
+ROWS = re.compile(r'\(\.\.\.\)(, \(\.\.\.\))+')
+WHITESPACE = re.compile(r'\s+')
+# The number of bind parameters logged, the rest are counted.
+MAX_PARAMETERS = 20
+
+
+def statement_shape(statement):
+    """
+    Returns statement with its whitespace, expanded IN lists and multi-row VALUES
+    normalized, so that the same query with a different number of ids or rows has the
+    same shape.
+    :param statement:
+    :return:
+    """
+    shape = IN_LIST.sub('(...)', WHITESPACE.sub(' ', statement).strip())
+    return ROWS.sub('(...), ...', shape)
+
+
+def redact(parameters):
+    """
+    Replaces every bind parameter value with its type.
+    :param parameters: a tuple, list or dict of values.
+    :return:
+    """
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        redacted = [redact(value) for value in parameters[:MAX_PARAMETERS]]
+        if len(parameters) > MAX_PARAMETERS:
+            redacted.append('... {} more'.format(len(parameters) - MAX_PARAMETERS))
+        return redacted
+    return None if parameters is None else '<{}>'.format(type(parameters).__name__)
+
+
+def request_resource():
+    """
+    Describes the request that issued a statement, if any.
+    :return:
+    """
+    if not has_request_context():
+        return None
+    return {'method': request.method, 'path': request.path, 'endpoint': request.endpoint}
+
+
+class SlowQueryLog:
+    """
+    The threshold and the counters of the slow query log.
+    """
+
+    def __init__(self, threshold_ms=DEFAULT_THRESHOLD_MS):
+        self._lock = threading.Lock()
+        self.threshold = threshold_ms / 1000.0
+        self.count = 0
+        self._explained = set()
+
+    def record(self, shape):
+        """
+        Counts a slow statement.
+        :param shape: see statement_shape().
+        :return: whether the shape wasn't slow before, i.e. its plan is wanted.
+        """
+        with self._lock:
+            self.count += 1
+            if shape in self._explained or len(self._explained) >= MAX_SHAPES:
+                return False
+            self._explained.add(shape)
+            return True
+
+    def json(self):
+        """
+        Returns the counters in dict format.
+        :return:
+        """
+        with self._lock:
+            return {'threshold_ms': self.threshold * 1000,
+                    'slow_queries': self.count,
+                    'explained_shapes': len(self._explained)}
+
+
+def app_log():
+    """
+    Returns the slow query log of the current app, if any.
+    :return:
+    """
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('slowlog')
+
+
+# The slow query log of the current app.
+slow_query_log = LocalProxy(lambda: current_app.extensions['slowlog'])
+
+
+def explain(conn, statement, parameters):
+    """
+    Returns the plan of a SELECT as a list of lines, or None for other statements and
+    other databases. It runs on a separate cursor, so the events aren't triggered again,
+    inside a savepoint: on PostgreSQL a failed statement aborts the whole transaction,
+    and the transaction is the request's. The savepoint is rolled back to if EXPLAIN
+    fails, which leaves the transaction as it was.
+    :param conn:
+    :param statement:
+    :param parameters:
+    :return:
+    """
+    prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+    if prefix is None or not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute('SAVEPOINT {}'.format(EXPLAIN_SAVEPOINT))
+        try:
+            cursor.execute(prefix + statement, parameters)
+            # A row is (id, parent, notused, detail) on SQLite and (line,) on PostgreSQL.
+            plan = [row[-1] for row in cursor.fetchall()]
+        except Exception:
+            cursor.execute('ROLLBACK TO SAVEPOINT {}'.format(EXPLAIN_SAVEPOINT))
+            raise
+        finally:
+            cursor.execute('RELEASE SAVEPOINT {}'.format(EXPLAIN_SAVEPOINT))
+        return plan
+    finally:
+        cursor.close()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Notes when a statement starts.
+    """
+    conn.info.setdefault('slowlog_query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Logs the statement if it took longer than the threshold.
+    """
+    starts = conn.info.get('slowlog_query_start')
+    if not starts:
+        return
+    seconds = time.perf_counter() - starts.pop()
+    log = app_log()
+    if log is None or not log.threshold or seconds < log.threshold:
+        return
+
+    shape = statement_shape(statement)
+    record = {'duration_ms': round(seconds * 1000, 3),
+              'statement': shape,
+              'parameters': '<{} rows>'.format(len(parameters)) if executemany else redact(parameters),
+              'resource': request_resource()}
+    if log.record(shape) and not executemany:
+        try:
+            plan = explain(conn, statement, parameters)
+        except Exception as e:
+            logger.debug("Could not explain %s: %s", shape, e)
+        else:
+            if plan is not None:
+                record['plan'] = plan
+    logger.warning(json.dumps(record))
+
+
+def handle_error(exception_context):
+    """
+    Drops the start of a statement that failed, which after_cursor_execute never sees.
+    """
+    starts = exception_context.connection.info.get('slowlog_query_start') \
+        if exception_context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def init_app(app):
+    """
+    Logs the statements slower than SLOW_QUERY_MS (milliseconds, 0 disables the log).
+    :param app:
+    """
+    threshold = app.config.setdefault('SLOW_QUERY_MS', DEFAULT_THRESHOLD_MS)
+    app.extensions['slowlog'] = SlowQueryLog(threshold)
+    if not threshold:
+        return
+    # Engine-wide, so every engine the app creates is covered.
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(Engine, 'handle_error', handle_error)
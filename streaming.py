@@ -0,0 +1,67 @@
+"""
+STREAMING
+Writes large lists out as JSON incrementally instead of building them in memory.
+"""
+from flask import Response, current_app, stream_with_context
+
+from representations import dumps
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def chunk_size():
+    """
+    The number of rows fetched from the database, and written out, at a time.
+    :return:
+    """
+    return current_app.config.get('STREAM_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def json_list_delimiters(encode, key):
+    """
+    Returns the bytes around and between the rows of {key: [row, ...]} as encode writes
+    them, so that a streamed document is byte for byte the buffered one: the standard
+    library puts spaces after ':' and ',', orjson doesn't.
+    :param encode: the encoder, e.g. dumps().
+    :param key: the name of the list in the document.
+    :return: a (prefix, separator, suffix) tuple.
+    """
+    document = encode({key: [0, 0]})
+    start = document.index(b'[') + 1
+    end = document.rindex(b']')
+    return document[:start], document[start + 1:end - 1], document[end:] + b'\n'
+
+
+def generate_json_list(key, rows, size):
+    """
+    Yields the JSON document {key: [row, ...]} piece by piece, encoded with the app's encoder
+    exactly like the buffered response, see json_list_delimiters().
+    :param key: the name of the list in the document.
+    :param rows: an iterable of rows in JSON (dict) format.
+    :param size: how many rows go into each yielded piece.
+    :return:
+    """
+    prefix, next_separator, suffix = json_list_delimiters(dumps, key)
+    yield prefix
+    separator = b''
+    parts = []
+    for row in rows:
+        parts.append(separator + dumps(row))
+        separator = next_separator
+        if len(parts) >= size:
+            yield b''.join(parts)
+            parts = []
+    parts.append(suffix)
+    yield b''.join(parts)
+
+
+def stream_json_list(key, rows):
+    """
+    Returns a streamed application/json response for the rows.
+    The request context is kept alive while streaming so the session stays usable.
+    :param key: the name of the list in the document.
+    :param rows: an iterable of rows in JSON (dict) format, read lazily while streaming.
+    :return:
+    """
+    return Response(stream_with_context(generate_json_list(key, rows, chunk_size())),
+                    mimetype='application/json')
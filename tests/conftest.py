@@ -0,0 +1,8 @@
+"""
+TESTS
+The tests import the app's modules from the repository root, like run.py does.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,64 @@
+"""
+TESTS | ASGI
+The ASGI app answers with the same status codes and JSON bodies as run:app.
+
+    python -m pytest tests
+"""
+import pytest
+from starlette.testclient import TestClient
+
+import asgi
+from app import create_app
+from db import init_db
+
+PATHS = ['/items?fields=name', '/items?fields=price,id&sort=-price', '/items?fields=name&paginate=false',
+         '/items?fields=name&stream=true', '/items?fields=bogus',
+         '/store/store-1?fields=name', '/store/store-1?embed=none', '/store/store-1?fields=items.price',
+         '/store/store-1?fields=id,items.name&embed=items', '/store/store-1?embed=bad',
+         '/stores?fields=name,items.name', '/stores?embed=none', '/stores?embed=none&paginate=false',
+         '/stores?fields=items.id&stream=true', '/stores?limit=1&fields=id', '/stores?fields=']
+
+
+@pytest.fixture(scope='module')
+def clients(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('asgi')
+    clients = []
+    for name in ('flask', 'asgi'):
+        uri = 'sqlite:///{}'.format(directory / '{}.db'.format(name))
+        app = create_app({'SQLALCHEMY_DATABASE_URI': uri, 'CACHE_MAXSIZE': 0, 'SLOW_QUERY_MS': 0})
+        init_db(app)
+        client = app.test_client() if name == 'flask' else TestClient(asgi.create_app(uri))
+        for store in ('store-1', 'store-2'):
+            client.post('/store/' + store)
+        for index, (price, store_id) in enumerate([(3.5, 1), (1.25, 2), (2.0, 1)]):
+            client.put('/item/item-{}'.format(index), json={'price': price, 'store_id': store_id})
+        clients.append(client)
+    return clients
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_fieldsets_match_flask(clients, path):
+    flask_client, asgi_client = clients
+    expected, actual = flask_client.get(path), asgi_client.get(path)
+    assert actual.status_code == expected.status_code
+    assert actual.json() == expected.get_json()
+
+
+def test_item_fieldset_matches_flask(clients):
+    responses = []
+    for client in clients:
+        client.post('/register', json={'username': 'user', 'password': 'secret'})
+        token = client.post('/auth', json={'username': 'user', 'password': 'secret'})
+        token = token.get_json() if client is clients[0] else token.json()
+        response = client.get('/item/item-0?fields=price,name',
+                              headers={'Authorization': 'JWT ' + token['access_token']})
+        responses.append((response.status_code, response.get_json() if client is clients[0] else response.json()))
+    assert responses[0] == responses[1] == (200, {'name': 'item-0', 'price': 3.5})
+
+
+@pytest.mark.parametrize('path', ['/items', '/stores', '/stores?embed=none'])
+def test_stream_matches_buffered(clients, path):
+    asgi_client = clients[1]
+    separator = '&' if '?' in path else '?'
+    buffered = asgi_client.get(path + separator + 'paginate=false')
+    assert asgi_client.get(path + separator + 'stream=true').content == buffered.content
@@ -0,0 +1,47 @@
+"""
+TESTS | CONDITIONAL
+Revalidations get a 304 with the ETag of the representation the client has.
+
+    python -m pytest tests
+"""
+import pytest
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from app import create_app
+from db import db, init_db
+
+
+@pytest.fixture
+def client():
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'SLOW_QUERY_MS': 0, 'COMPRESS_MIN_SIZE': 0})
+    init_db(app)
+    with app.app_context():
+        client = app.test_client()
+        client.post('/store/store-1')
+        client.put('/item/item-1', json={'price': 1.5, 'store_id': 1})
+        yield client
+        db.session.remove()
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'identity'])
+def test_not_modified_keeps_the_etag(client, encoding):
+    headers = {'Accept-Encoding': encoding}
+    response = client.get('/items', headers=headers)
+    etag = response.headers['ETag']
+    assert etag.endswith('-gzip"') == (encoding == 'gzip')
+
+    # The raw headers: the test client's response object would add a default Content-Type.
+    environ = EnvironBuilder('/items', headers=dict(headers, **{'If-None-Match': etag})).get_environ()
+    body, status, revalidated = run_wsgi_app(client.application, environ, buffered=True)
+    assert status.startswith('304')
+    assert revalidated['ETag'] == etag
+    assert 'Content-Type' not in revalidated
+    assert b''.join(body) == b''
+
+
+def test_changed_data_is_sent_again(client):
+    etag = client.get('/items').headers['ETag']
+    client.put('/item/item-1', json={'price': 2.5, 'store_id': 1})
+    response = client.get('/items', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
@@ -0,0 +1,63 @@
+"""
+TESTS | ITEMS
+Writes of items through /item/<name> and /items/bulk.
+
+    python -m pytest tests
+"""
+import pytest
+
+from app import create_app
+from db import db, init_db
+from models.item import ItemModel
+
+
+@pytest.fixture
+def client():
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'SLOW_QUERY_MS': 0})
+    init_db(app)
+    with app.app_context():
+        client = app.test_client()
+        client.post('/store/store-1')
+        yield client
+        db.session.remove()
+
+
+@pytest.mark.parametrize('method', ['post', 'put'])
+@pytest.mark.parametrize('price', [float('nan'), float('inf'), float('-inf')])
+def test_non_finite_json_price_is_rejected(client, method, price):
+    response = getattr(client, method)('/item/item-1', json={'price': price, 'store_id': 1})
+    assert response.status_code == 400, response.get_json()
+    assert client.get('/items').get_json()['items'] == []
+
+
+@pytest.mark.parametrize('method', ['post', 'put'])
+def test_non_finite_form_price_is_rejected(client, method):
+    response = getattr(client, method)('/item/item-1', data={'price': 'nan', 'store_id': '1'})
+    assert response.status_code == 400, response.get_json()
+
+
+def test_non_finite_bulk_price_is_rejected(client):
+    response = client.post('/items/bulk', json=[{'name': 'item-1', 'price': float('nan'), 'store_id': 1},
+                                                {'name': 'item-2', 'price': 2.5, 'store_id': 1}])
+    assert response.status_code == 200
+    assert [result['status'] for result in response.get_json()['results']] == ['error', 'created']
+
+
+@pytest.mark.parametrize('method', ['post', 'put'])
+def test_finite_price_is_returned_as_float(client, method):
+    response = getattr(client, method)('/item/item-1', json={'price': 6, 'store_id': 1})
+    assert response.status_code in (200, 201)
+    assert response.get_json() == {'id': 1, 'name': 'item-1', 'price': 6.0, 'store_id': 1}
+    assert isinstance(response.get_json()['price'], float)
+
+
+@pytest.mark.parametrize('method', ['post', 'put'])
+def test_failed_write_rolls_back(client, method, monkeypatch):
+    def fail(*args, **kwargs):
+        db.session.execute(ItemModel.__table__.insert().values(name='half-written', price=1.0, store_id=1))
+        raise RuntimeError('boom')
+    monkeypatch.setattr(ItemModel, 'bump_versions', fail)
+    response = getattr(client, method)('/item/item-1', json={'price': 1.5, 'store_id': 1})
+    assert response.status_code == 500
+    monkeypatch.undo()
+    assert client.get('/items').get_json()['items'] == []
@@ -0,0 +1,111 @@
+"""
+TESTS | QUERY COUNTS
+The number of statements an endpoint executes must not grow with the number of
+rows it returns, see benchmarks/query_counts.py.
+
+    python -m pytest tests
+"""
+import pytest
+
+from app import create_app
+from benchmarks.common import QueryCounter
+from db import db, init_db
+from models.item import ItemModel
+from models.store import StoreModel
+
+SIZES = (1, 25)
+
+
+@pytest.fixture
+def app():
+    # The caches would hide the statements, the slow query log would add EXPLAINs.
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'CACHE_MAXSIZE': 0, 'SLOW_QUERY_MS': 0})
+    init_db(app)
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    # Keep the one-off costs of the first request, and of detecting the search
+    # index, out of the counts.
+    client.get('/stores')
+    client.get('/items/search?q=item')
+    return client
+
+
+def seed(stores, items_per_store=3):
+    """
+    Replaces the stores and items with the given number of them.
+    :param stores:
+    :param items_per_store:
+    """
+    db.session.execute(ItemModel.__table__.delete())
+    db.session.execute(StoreModel.__table__.delete())
+    db.session.execute(StoreModel.__table__.insert(),
+                       [{'id': i, 'name': 'store-{}'.format(i)} for i in range(1, stores + 1)])
+    db.session.execute(ItemModel.__table__.insert(),
+                       [{'name': 'item-{}-{}'.format(s, i), 'price': 1.0 + i, 'store_id': s}
+                        for s in range(1, stores + 1) for i in range(items_per_store)])
+    db.session.commit()
+
+
+def count_queries(client, method, path, **kwargs):
+    """
+    Returns the number of statements a request executes.
+    :param client:
+    :param method: e.g. 'get'.
+    :param path:
+    :return:
+    """
+    with QueryCounter(db.engine) as counter:
+        response = getattr(client, method)(path, **kwargs)
+    assert response.status_code in (200, 201), response.get_json()
+    return counter.count
+
+
+@pytest.mark.parametrize('path', ['/stores', '/stores?paginate=false', '/store/store-1',
+                                  '/store/store-1?fields=name,items.name', '/stores?fields=name,items.price'])
+def test_stores_query_count_is_constant(client, path):
+    counts = []
+    for stores in SIZES:
+        seed(stores)
+        counts.append(count_queries(client, 'get', path))
+    assert len(set(counts)) == 1, counts
+
+
+@pytest.mark.parametrize('path', ['/stores/summary', '/store/store-1/summary'])
+def test_summaries_query_count_is_constant(client, path):
+    counts = []
+    for stores in SIZES:
+        seed(stores, items_per_store=stores)
+        counts.append(count_queries(client, 'get', path))
+    assert len(set(counts)) == 1, counts
+
+
+def test_search_query_count_is_constant(client):
+    counts = []
+    for stores in SIZES:
+        seed(stores)
+        counts.append(count_queries(client, 'get', '/items/search?q=item'))
+    assert len(set(counts)) == 1, counts
+
+
+def test_bulk_query_count_is_constant(client):
+    counts = []
+    for rows in SIZES:
+        seed(1)
+        body = [{'name': 'bulk-{}'.format(i), 'price': 2.5, 'store_id': 1} for i in range(rows)]
+        counts.append(count_queries(client, 'post', '/items/bulk', json=body))
+    assert len(set(counts)) == 1, counts
+
+
+@pytest.mark.parametrize('method', ['post', 'put'])
+def test_item_writes_are_one_upsert(client, method):
+    seed(1)
+    counts = [count_queries(client, method, '/item/new', json={'price': 1.5, 'store_id': 1}),
+              count_queries(client, 'put', '/item/new', json={'price': 2.5, 'store_id': 1})]
+    # The upsert, which returns the row, and the store's data version.
+    assert counts == [2, 2], counts
@@ -0,0 +1,23 @@
+"""
+TESTS | REPLICAS
+Writes go to the primary even in sessions that read from a replica.
+
+    python -m pytest tests
+"""
+from app import create_app
+from db import db, init_db, upsert_returning
+from models.item import ItemModel
+
+
+def test_upsert_returning_goes_to_the_primary(tmp_path):
+    primary, replica = ('sqlite:///{}'.format(tmp_path / name) for name in ('primary.db', 'replica.db'))
+    app = create_app({'SQLALCHEMY_DATABASE_URI': primary, 'DATABASE_REPLICA_URLS': [replica], 'SLOW_QUERY_MS': 0})
+    init_db(app)
+    with app.app_context():
+        session = db.session()
+        assert session.use_replica() is not None
+        statement = ItemModel.upsert_statement('item-1', 1.0, None)
+        returning = upsert_returning(statement, ItemModel.__table__.c)
+        assert session.get_bind(clause=returning) is db.engine
+        assert session.info['wrote']
+        db.session.remove()
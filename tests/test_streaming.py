@@ -0,0 +1,30 @@
+"""
+TESTS | STREAMING
+?stream=true writes the same bytes as the buffered ?paginate=false.
+
+    python -m pytest tests
+"""
+import pytest
+
+from app import create_app
+from db import db, init_db
+from representations import ENCODERS
+
+
+@pytest.mark.parametrize('encoder', sorted(ENCODERS))
+@pytest.mark.parametrize('path', ['/items', '/stores', '/stores?fields=name,items.price', '/items?min_price=100'])
+def test_stream_matches_buffered(encoder, path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'JSON_ENCODER': encoder, 'STREAM_CHUNK_SIZE': 2,
+                      'SLOW_QUERY_MS': 0})
+    init_db(app)
+    with app.app_context():
+        client = app.test_client()
+        for store in ('store-1', 'store-2'):
+            client.post('/store/' + store)
+        for index in range(5):
+            client.put('/item/item-{}'.format(index), json={'price': index + 0.5, 'store_id': index % 2 + 1})
+        separator = '&' if '?' in path else '?'
+        buffered = client.get(path + separator + 'paginate=false')
+        streamed = client.get(path + separator + 'stream=true')
+        assert streamed.data == buffered.data
+        db.session.remove()
@@ -0,0 +1,154 @@
+"""
+TIMING
+Opt-in per-request accounting of SQL queries, database time, JSON serialization
+time and total handler time, sent as a Server-Timing header and logged as one
+JSON line per request.
+"""
+import functools
+import json
+import logging
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTiming:
+    """
+    The counters of one request.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+
+    def elapsed(self):
+        """
+        The seconds since the request started.
+        :return:
+        """
+        return time.perf_counter() - self.start
+
+    def header(self, total_seconds):
+        """
+        Returns the value of the Server-Timing header.
+        :param total_seconds:
+        :return:
+        """
+        return 'db;dur={:.2f};desc="{} queries", serialize;dur={:.2f}, total;dur={:.2f}'.format(
+            self.db_seconds * 1000, self.queries, self.serialize_seconds * 1000, total_seconds * 1000)
+
+    def json(self, total_seconds):
+        """
+        Returns the counters in dict format, for the log line.
+        :param total_seconds:
+        :return:
+        """
+        return {'queries': self.queries,
+                'db_ms': round(self.db_seconds * 1000, 3),
+                'serialize_ms': round(self.serialize_seconds * 1000, 3),
+                'total_ms': round(total_seconds * 1000, 3)}
+
+
+def current_timing():
+    """
+    The RequestTiming of the current request, or None outside of a request.
+    :return:
+    """
+    if has_request_context():
+        return g.get('request_timing')
+    return None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Notes when a statement of a timed request starts.
+    """
+    if current_timing() is not None:
+        conn.info.setdefault('timing_query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Adds a finished statement to the current request's counters.
+    """
+    timing = current_timing()
+    starts = conn.info.get('timing_query_start')
+    if timing is not None and starts:
+        timing.queries += 1
+        timing.db_seconds += time.perf_counter() - starts.pop()
+
+
+def handle_error(exception_context):
+    """
+    Drops the start of a statement that failed, which after_cursor_execute never sees.
+    """
+    starts = exception_context.connection.info.get('timing_query_start') \
+        if exception_context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def timed_encoder(encoder):
+    """
+    Wraps a JSON encoder of representations.ENCODERS to add its time to the request's.
+    :param encoder:
+    :return:
+    """
+    @functools.wraps(encoder)
+    def wrapper(data):
+        timing = current_timing()
+        if timing is None:
+            return encoder(data)
+        start = time.perf_counter()
+        try:
+            return encoder(data)
+        finally:
+            timing.serialize_seconds += time.perf_counter() - start
+    return wrapper
+
+
+def init_app(app):
+    """
+    Times every request of app when SERVER_TIMING is true. Nothing is hooked otherwise,
+    so a disabled app pays nothing. Call it after representations.init_app().
+    :param app:
+    """
+    if not app.config.setdefault('SERVER_TIMING', False):
+        return
+
+    # Engine-wide, so every engine the app creates is covered.
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(Engine, 'handle_error', handle_error)
+    app.extensions['json_encoder'] = timed_encoder(app.extensions['json_encoder'])
+
+    @app.before_request
+    def start_timing():
+        g.request_timing = RequestTiming()
+
+    @app.after_request
+    def add_server_timing(response):
+        """
+        Sends the timings so far, and logs the final ones once the response is closed:
+        streamed bodies are serialized after the headers are sent.
+        """
+        timing = current_timing()
+        if timing is None:
+            return response
+        response.headers['Server-Timing'] = timing.header(timing.elapsed())
+        # The request context may be gone by the time the response is closed.
+        record = {'method': request.method, 'path': request.path,
+                  'endpoint': request.endpoint, 'status': response.status_code}
+
+        @response.call_on_close
+        def log_timing():
+            record.update(timing.json(timing.elapsed()))
+            logger.info(json.dumps(record))
+        return response